@@ -0,0 +1,91 @@
+# TIME VARYING ARRIVALS
+# Sampling the time to the next arrival from an exponential distribution with
+# a fixed mean assumes patients are just as likely to turn up at 3am on a
+# Sunday as at 11am on a Monday.  Real demand follows daily and weekly
+# patterns, which we can describe with a table of arrival rates - e.g. one
+# for each hour of the day (24 rates), or of the week (168 rates), repeating
+# over and over.
+#
+# Arrivals like this are a non-homogeneous Poisson process, and we can sample
+# them exactly by inversion.  The cumulative intensity L(t) is the expected
+# number of arrivals by time t - the area under the rate table up to t.
+# With a constant rate, the time between arrivals is exponential, so L goes
+# up by a standard exponential (mean 1) random number between one arrival
+# and the next.  The same is true with varying rates, so to get the next
+# arrival time, we add a standard exponential to L(now), and find the time
+# at which L reaches that value.  As the rate table is piecewise constant, L
+# is piecewise linear, and both directions just need a binary search of the
+# rate table's running totals.  Each arrival costs one random number and two
+# binary searches, whatever the number of rates - and periods with a rate of
+# 0 are skipped over without any extra work.
+#
+# For the engines that work out every arrival at once (e.g. network_engine),
+# arrival_times() does the same for a whole array of random numbers at once.
+
+import bisect
+import numpy as np
+
+# Class representing arrivals following a table of rates (expected arrivals
+# per unit of time), each covering period_length units of time, repeating
+# once the end of the table is reached
+class Piecewise_Arrival_Process:
+    def __init__(self, rates, period_length=60):
+        self.rates = [float(rate) for rate in rates]
+        self.period_length = period_length
+
+        if min(self.rates) < 0 or max(self.rates) == 0:
+            raise ValueError("Arrival rates can't be negative, and at " +
+                             "least one must be above 0")
+
+        self.cycle_length = len(self.rates) * period_length
+
+        # The cumulative intensity at the start of each period (and at the
+        # end of the table)
+        self.cumulative = [0.0]
+
+        for rate in self.rates:
+            self.cumulative.append(self.cumulative[-1] + rate * period_length)
+
+        self.cycle_intensity = self.cumulative[-1]
+
+    # Method to work out the cumulative intensity at time t
+    def cumulative_intensity(self, t):
+        cycles, offset = divmod(t, self.cycle_length)
+        period = min(int(offset // self.period_length), len(self.rates) - 1)
+
+        return (cycles * self.cycle_intensity
+                + self.cumulative[period]
+                + self.rates[period] * (offset - period * self.period_length))
+
+    # Method to work out the time at which the cumulative intensity reaches
+    # the given value.  The binary search finds the last period starting at
+    # or below the value, which always has a rate above 0
+    def inverse_cumulative_intensity(self, value):
+        cycles, remainder = divmod(value, self.cycle_intensity)
+        period = bisect.bisect_right(self.cumulative, remainder) - 1
+
+        return (cycles * self.cycle_length
+                + period * self.period_length
+                + (remainder - self.cumulative[period]) / self.rates[period])
+
+    # Method to sample the time from now until the next arrival, given a
+    # standard exponential random number (e.g. from a Block_Stream)
+    def interarrival_time(self, now, standard_exponential):
+        return self.inverse_cumulative_intensity(
+            self.cumulative_intensity(now) + standard_exponential) - now
+
+    # Method to work out the arrival times for a whole array of standard
+    # exponential random numbers at once - one row per run, with the first
+    # arrival after start in the first column, and so on
+    def arrival_times(self, standard_exponentials, start=0.0):
+        cumulative = np.asarray(self.cumulative)
+        rates = np.asarray(self.rates)
+
+        values = (self.cumulative_intensity(start)
+                  + np.cumsum(standard_exponentials, axis=-1))
+        cycles, remainder = np.divmod(values, self.cycle_intensity)
+        period = np.searchsorted(cumulative, remainder, side="right") - 1
+
+        return (cycles * self.cycle_length
+                + period * self.period_length
+                + (remainder - cumulative[period]) / rates[period])
@@ -0,0 +1,119 @@
+# BUCKETED PRIORITY QUEUES
+# A SimPy PriorityResource keeps the requests waiting for it in a list, and
+# sorts the whole list again every time a request joins the queue, so with
+# long queues, each new patient takes longer and longer to add.
+#
+# When there are only a few priorities (e.g. the ED patients in
+# oop_simpy_4_priority_queue.py have priority 1 to 5), we can do much better.
+# We keep a separate first come first served queue (a deque) for each
+# priority - a "bucket" - and a bitmap with a 1 for each bucket that has
+# anyone in it.  Joining the queue just means adding to the end of the right
+# bucket, and the next request to be seen is the first in the lowest numbered
+# bucket with anyone in it, which the bitmap gives us straight away.  Both
+# take the same time however long the queue is.
+#
+# Requests with the same priority are seen in the order they joined the
+# queue, so this gives the same order as a PriorityResource (which sorts by
+# priority, then by the time of the request).  As with a PriorityResource,
+# the preempt flag of a request is ignored.
+
+from collections import deque
+import itertools
+import simpy
+
+# Class representing a queue of requests, with a bucket for each of the given
+# priorities (which must be whole numbers).  It has the list methods SimPy
+# uses for a resource's queue.  A request with a priority outside them
+# raises a ValueError
+class Bucket_Queue:
+    def __init__(self, priorities):
+        self.lowest_priority = min(priorities)
+        self.buckets = [deque() for _ in
+                        range(max(priorities) - self.lowest_priority + 1)]
+
+        # Bit i of non_empty is 1 if bucket i has anyone in it
+        self.non_empty = 0
+        self.length = 0
+
+    # Method to work out which bucket a request goes in
+    def bucket_number(self, request):
+        bucket_number = request.priority - self.lowest_priority
+
+        if not 0 <= bucket_number < len(self.buckets):
+            raise ValueError(
+                f"Priority {request.priority} is outside the priorities " +
+                f"this queue was set up for ({self.lowest_priority} to " +
+                f"{self.lowest_priority + len(self.buckets) - 1})")
+
+        return bucket_number
+
+    # Method to find the lowest numbered bucket with anyone in it (the lowest
+    # set bit of the bitmap)
+    def first_bucket_number(self):
+        return (self.non_empty & -self.non_empty).bit_length() - 1
+
+    def append(self, request):
+        bucket_number = self.bucket_number(request)
+
+        self.buckets[bucket_number].append(request)
+        self.non_empty |= 1 << bucket_number
+        self.length += 1
+
+    def remove(self, request):
+        bucket_number = self.bucket_number(request)
+        bucket = self.buckets[bucket_number]
+
+        bucket.remove(request)
+        self.length -= 1
+
+        if not bucket:
+            self.non_empty &= ~(1 << bucket_number)
+
+    # SimPy only ever looks at, and takes, the request at the front of the
+    # queue, which is quick.  Anywhere else means going through the buckets
+    def pop(self, index=-1):
+        if index == 0 and self.length > 0:
+            bucket_number = self.first_bucket_number()
+            bucket = self.buckets[bucket_number]
+            request = bucket.popleft()
+            self.length -= 1
+
+            if not bucket:
+                self.non_empty &= ~(1 << bucket_number)
+
+            return request
+
+        request = self[index]
+        self.remove(request)
+
+        return request
+
+    def __getitem__(self, index):
+        if index == 0 and self.length > 0:
+            return self.buckets[self.first_bucket_number()][0]
+
+        return list(self)[index]
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.buckets)
+
+# Class representing a PriorityResource that keeps its queue in a
+# Bucket_Queue, for requests with the given priorities (e.g. range(1, 6)).
+# Every request must have one of those priorities.  A request without a
+# priority gets the most urgent one (the lowest number), as it would with a
+# PriorityResource, where the default priority is 0
+class Bucket_Priority_Resource(simpy.PriorityResource):
+    def __init__(self, env, capacity=1, priorities=range(1, 6)):
+        super().__init__(env, capacity)
+
+        self.put_queue = Bucket_Queue(priorities)
+        self.queue = self.put_queue
+
+    def request(self, priority=None, preempt=True):
+        if priority is None:
+            priority = self.put_queue.lowest_priority
+
+        return super().request(priority, preempt)
@@ -20,7 +20,9 @@
 
 import simpy
 import random
-from statistics import mean
+from online_statistics import Welford_Accumulator
+from output_analysis import Batch_Means_Accumulator
+from patience import Patience_Monitor
 import csv
 import pandas as pd
 
@@ -37,7 +39,12 @@ def patient_generator_dn(env, dn_inter, mean_visit, district_nurse):
 
 # Activity Generator
 def activity_generator_dn(env, mean_visit, district_nurse):
-    global list_of_queuing_times_dn
+    global queuing_time_stats_dn
+    global queuing_time_batches_dn
+    global mean_patience
+    global balk_threshold
+    global patience_monitor
+    global abandonments_dn
     global warm_up_period
 
     time_entered_queue_for_dn = env.now
@@ -46,6 +53,16 @@ def activity_generator_dn(env, mean_visit, district_nurse):
     # the number of district nurse minutes to remove (i.e the visit duration)
     dn_mins_sampled = random.expovariate(1.0 / mean_visit)
 
+    # If too many people are already waiting for the district nurse, the
+    # patient balks (doesn't join the queue).  The requests waiting to get
+    # something from a container are in its get_queue
+    if (balk_threshold is not None and
+            len(district_nurse.get_queue) >= balk_threshold):
+        if env.now > warm_up_period:
+            abandonments_dn["Balked"] += 1
+
+        return
+
     # We can use the level attribute of the container to find out the current
     # level of the container (how many hours in the pot here)
     print(f"DN mins available before request : {district_nurse.level}")
@@ -58,7 +75,29 @@ def activity_generator_dn(env, mean_visit, district_nurse):
     # the program will still appear to work, but no queues will form if there
     # are insufficient levels of resource in the container (because the
     # generator function will just carry on regardless)
-    yield district_nurse.get(dn_mins_sampled)
+    dn_get = district_nurse.get(dn_mins_sampled)
+
+    # If patients can give up waiting, they wait for whichever comes first
+    # out of getting the district nurse minutes and their patience running
+    # out (see patience.py).  If it's their patience, they cancel the get,
+    # which takes them out of the queue, and leave (renege).  Patients who
+    # don't have to wait don't need a patience
+    if mean_patience is None or dn_get.triggered:
+        yield dn_get
+    else:
+        patience = random.expovariate(1.0 / mean_patience)
+
+        yield patience_monitor.wait(dn_get, patience)
+
+        if not dn_get.triggered:
+            dn_get.cancel()
+
+            if env.now > warm_up_period:
+                abandonments_dn["Reneged"] += 1
+                abandonments_dn["Wait_Before_Reneging"] += (
+                    env.now - time_entered_queue_for_dn)
+
+            return
 
     print(f"DN mins available after request : {district_nurse.level}")
 
@@ -68,7 +107,8 @@ def activity_generator_dn(env, mean_visit, district_nurse):
     time_queuing_for_dn = (time_left_queue_for_dn - time_entered_queue_for_dn)
 
     if env.now > warm_up_period:
-        list_of_queuing_times_dn.append(time_queuing_for_dn)
+        queuing_time_stats_dn.update(time_queuing_for_dn)
+        queuing_time_batches_dn.update(time_queuing_for_dn)
     
     # Call the timeout for the length of the visit (obviously here that's the
     # same as the amount of resource we've taken from the container, but
@@ -87,11 +127,38 @@ number_of_simulation_runs = 100
 results_collection_period = 1440
 warm_up_period = 2880
 
+# For questions about how the system behaves in the long run, we don't need
+# to pay for the warm up period on every run.  Set batch_means_mode to True to
+# do a single long run instead (with the same total results collection period
+# as all of the runs put together), and get the confidence interval using the
+# method of batch means (see output_analysis.py)
+batch_means_mode = False
+
+# Set mean_patience to make patients give up waiting (renege) if they've
+# waited longer than their patience, which is sampled from an exponential
+# distribution with the given mean (e.g. 120).  Set balk_threshold to make
+# patients leave rather than join the queue (balk) if that many people are
+# already waiting in it (e.g. 20).  Either way, we count how many left after
+# the warm up period, and how long those who reneged waited first
+mean_patience = None
+balk_threshold = None
+abandonment = mean_patience is not None or balk_threshold is not None
+
+if batch_means_mode:
+    results_collection_period *= number_of_simulation_runs
+    number_of_simulation_runs = 1
+
 # Create a file to store the results of each, run and write the column headers
 with open("dn_results.csv", "w") as f:
     writer = csv.writer(f, delimiter=",")
 
-    writer.writerow(["Run", "Mean Q DN"])
+    column_headers = ["Run", "Mean Q DN"]
+
+    if abandonment:
+        column_headers += ["Balked DN", "Reneged DN",
+                           "Mean Wait Before Reneging DN"]
+
+    writer.writerow(column_headers)
 
 for run in range(number_of_simulation_runs):
     # Set up simulation environment
@@ -108,8 +175,14 @@ for run in range(number_of_simulation_runs):
     dn_inter = 10
     mean_visit = 60
 
-    # Set up list to store queuing times
-    list_of_queuing_times_dn = []
+    # Set up an accumulator to keep statistics on queuing times
+    queuing_time_stats_dn = Welford_Accumulator()
+    queuing_time_batches_dn = Batch_Means_Accumulator()
+
+    # Set up the patience monitor, and the counts of patients who left
+    # without being seen
+    patience_monitor = Patience_Monitor(env)
+    abandonments_dn = {"Balked":0, "Reneged":0, "Wait_Before_Reneging":0.0}
 
     # Start the arrivals generator
     env.process(patient_generator_dn(env, dn_inter, mean_visit,
@@ -118,8 +191,8 @@ for run in range(number_of_simulation_runs):
     # Run the simulation for the warm up period + the results collection period
     env.run(until=(results_collection_period + warm_up_period))
 
-    # Calculate and print average queuing time
-    mean_queuing_time_dn = mean(list_of_queuing_times_dn)
+    # Print average queuing time
+    mean_queuing_time_dn = queuing_time_stats_dn.mean
 
     print("Mean queuing time for the district nurse (mins) :",
           f"{mean_queuing_time_dn:.2f}")
@@ -128,6 +201,21 @@ for run in range(number_of_simulation_runs):
     # the mean queuing time for the nurse in that run
     list_to_write = [run, mean_queuing_time_dn]
 
+    # If patients can leave the queue, add how many balked and reneged, and
+    # how long those who reneged waited on average
+    if abandonment:
+        reneged_dn = abandonments_dn["Reneged"]
+        mean_wait_before_reneging_dn = (
+            abandonments_dn["Wait_Before_Reneging"] / reneged_dn
+            if reneged_dn > 0 else float("nan"))
+
+        print (f"Balked : {abandonments_dn['Balked']}, reneged : " +
+               f"{reneged_dn} (after waiting " +
+               f"{mean_wait_before_reneging_dn:.2f} mins on average)")
+
+        list_to_write += [abandonments_dn["Balked"], reneged_dn,
+                          mean_wait_before_reneging_dn]
+
     # Store the run results to file. We need to open in append mode ("a"),
     # otherwise we'll overwrite the file each time.  That's why we set up the
     # new file before the for loop, to start anew for each batch of runs
@@ -151,7 +239,18 @@ for run in range(number_of_simulation_runs):
     min_trial_queuing_time_dn = results_df["Mean Q DN"].min()
 
     print (f"Max mean queuing result over trial : {max_trial_queuing_time_dn:.2f}")
-    print (f"Min mean queuing result over trial : {min_trial_queuing_time_dn:.2f}")#!/usr/bin/env python3
+    print (f"Min mean queuing result over trial : {min_trial_queuing_time_dn:.2f}")
+
+# In batch means mode, the confidence interval comes from the batch means of
+# our single long run
+if batch_means_mode:
+    batch_mean, half_width, batch_size, number_of_batches = (
+        queuing_time_batches_dn.confidence_interval())
+
+    print (f"Mean queuing time : {batch_mean:.2f} +/- {half_width:.2f} " +
+           f"(half width from {number_of_batches} batch means of " +
+           f"{batch_size} patients)")
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
 Created on Tue Aug 11 15:34:30 2020
@@ -163,7 +262,9 @@ Created on Tue Aug 11 15:34:30 2020
 import simpy
 import random
 import csv
-from statistics import mean
+from online_statistics import Welford_Accumulator
+from output_analysis import Batch_Means_Accumulator
+from patience import Patience_Monitor
 import pandas as pd
 
 # Arrivals generator function
@@ -179,7 +280,12 @@ def patient_generator_dn(env, dn_inter, mean_visit, district_nurse):
         
 # Activity Generator
 def activity_generator_dn(env, mean_visit, district_nurse):
-    global list_of_queuing_times_dn
+    global queuing_time_stats_dn
+    global queuing_time_batches_dn
+    global mean_patience
+    global balk_threshold
+    global patience_monitor
+    global abandonments_dn
     global warm_up_period
     
     time_entered_queue_for_dn = env.now
@@ -187,6 +293,16 @@ def activity_generator_dn(env, mean_visit, district_nurse):
     # Calculate how much resource to take from the container; here, this is
     # the number of district nurse minutes to remove (ie the visit duration)
     dn_mins_sampled = random.expovariate(1.0 / mean_visit)
+
+    # If too many people are already waiting for the district nurse, the
+    # patient balks (doesn't join the queue).  The requests waiting to get
+    # something from a container are in its get_queue
+    if (balk_threshold is not None and
+            len(district_nurse.get_queue) >= balk_threshold):
+        if env.now > warm_up_period:
+            abandonments_dn["Balked"] += 1
+
+        return
     
     # We can use the level attribute of the container to find out the current
     # level of the container (how many hours in the pot here)
@@ -200,7 +316,29 @@ def activity_generator_dn(env, mean_visit, district_nurse):
     # the program will still appear to work, but no queues will form if there
     # are insufficient levels of resource in the container (because the
     # generator function will just carry on regardless)
-    yield district_nurse.get(dn_mins_sampled)
+    dn_get = district_nurse.get(dn_mins_sampled)
+
+    # If patients can give up waiting, they wait for whichever comes first
+    # out of getting the district nurse minutes and their patience running
+    # out (see patience.py).  If it's their patience, they cancel the get,
+    # which takes them out of the queue, and leave (renege).  Patients who
+    # don't have to wait don't need a patience
+    if mean_patience is None or dn_get.triggered:
+        yield dn_get
+    else:
+        patience = random.expovariate(1.0 / mean_patience)
+
+        yield patience_monitor.wait(dn_get, patience)
+
+        if not dn_get.triggered:
+            dn_get.cancel()
+
+            if env.now > warm_up_period:
+                abandonments_dn["Reneged"] += 1
+                abandonments_dn["Wait_Before_Reneging"] += (
+                    env.now - time_entered_queue_for_dn)
+
+            return
     
     print (f"DN mins available after request : {district_nurse.level}")
     
@@ -210,7 +348,8 @@ def activity_generator_dn(env, mean_visit, district_nurse):
     time_queuing_for_dn = (time_left_queue_for_dn - time_entered_queue_for_dn)
     
     if env.now > warm_up_period:
-        list_of_queuing_times_dn.append(time_queuing_for_dn)
+        queuing_time_stats_dn.update(time_queuing_for_dn)
+        queuing_time_batches_dn.update(time_queuing_for_dn)
     
     # Call the timeout for the length of the visit (obviously here that's the
     # same as the amount of resource we've taken from the container, but
@@ -229,11 +368,38 @@ number_of_simulation_runs = 100
 results_collection_period = 1440
 warm_up_period = 2880
 
+# For questions about how the system behaves in the long run, we don't need
+# to pay for the warm up period on every run.  Set batch_means_mode to True to
+# do a single long run instead (with the same total results collection period
+# as all of the runs put together), and get the confidence interval using the
+# method of batch means (see output_analysis.py)
+batch_means_mode = False
+
+# Set mean_patience to make patients give up waiting (renege) if they've
+# waited longer than their patience, which is sampled from an exponential
+# distribution with the given mean (e.g. 120).  Set balk_threshold to make
+# patients leave rather than join the queue (balk) if that many people are
+# already waiting in it (e.g. 20).  Either way, we count how many left after
+# the warm up period, and how long those who reneged waited first
+mean_patience = None
+balk_threshold = None
+abandonment = mean_patience is not None or balk_threshold is not None
+
+if batch_means_mode:
+    results_collection_period *= number_of_simulation_runs
+    number_of_simulation_runs = 1
+
 # Create a file to store the results of each run, and write the column headers
 with open("dn_results.csv", "w") as f:
     writer = csv.writer(f, delimiter=",")
     
-    writer.writerow(["Run", "Mean Q DN"])
+    column_headers = ["Run", "Mean Q DN"]
+
+    if abandonment:
+        column_headers += ["Balked DN", "Reneged DN",
+                           "Mean Wait Before Reneging DN"]
+
+    writer.writerow(column_headers)
 
 for run in range(number_of_simulation_runs):
     # Set up simulation environment
@@ -250,8 +416,14 @@ for run in range(number_of_simulation_runs):
     dn_inter = 10
     mean_visit = 60
     
-    # Set up list to store queuing times
-    list_of_queuing_times_dn = []
+    # Set up an accumulator to keep statistics on queuing times
+    queuing_time_stats_dn = Welford_Accumulator()
+    queuing_time_batches_dn = Batch_Means_Accumulator()
+
+    # Set up the patience monitor, and the counts of patients who left
+    # without being seen
+    patience_monitor = Patience_Monitor(env)
+    abandonments_dn = {"Balked":0, "Reneged":0, "Wait_Before_Reneging":0.0}
     
     # Start the arrivals generator
     env.process(patient_generator_dn(env, dn_inter, mean_visit, 
@@ -260,8 +432,8 @@ for run in range(number_of_simulation_runs):
     # Run the simulation for the warm up period + the results collection period
     env.run(until=(results_collection_period + warm_up_period))
     
-    # Calculate and print average queuing time
-    mean_queuing_time_dn = mean(list_of_queuing_times_dn)
+    # Print average queuing time
+    mean_queuing_time_dn = queuing_time_stats_dn.mean
     
     print ("Mean queuing time for the district nurse (mins) :",
            f"{mean_queuing_time_dn:.2f}")
@@ -269,6 +441,21 @@ for run in range(number_of_simulation_runs):
     # Set up list to write to file - here we'll store the run number alongside
     # the mean queuing time for the nurse in that run
     list_to_write = [run, mean_queuing_time_dn]
+
+    # If patients can leave the queue, add how many balked and reneged, and
+    # how long those who reneged waited on average
+    if abandonment:
+        reneged_dn = abandonments_dn["Reneged"]
+        mean_wait_before_reneging_dn = (
+            abandonments_dn["Wait_Before_Reneging"] / reneged_dn
+            if reneged_dn > 0 else float("nan"))
+
+        print (f"Balked : {abandonments_dn['Balked']}, reneged : " +
+               f"{reneged_dn} (after waiting " +
+               f"{mean_wait_before_reneging_dn:.2f} mins on average)")
+
+        list_to_write += [abandonments_dn["Balked"], reneged_dn,
+                          mean_wait_before_reneging_dn]
     
     # Store the run results to file.  We need to open in append mode ("a"),
     # otherwise we'll overwrite the file each time.  That's why we set up the
@@ -294,3 +481,13 @@ min_trial_queuing_time_dn = results_df["Mean Q DN"].min()
 
 print (f"Max mean queuing result over trial : {max_trial_queuing_time_dn:.2f}")
 print (f"Min mean queuing result over trial : {min_trial_queuing_time_dn:.2f}")
+
+# In batch means mode, the confidence interval comes from the batch means of
+# our single long run
+if batch_means_mode:
+    batch_mean, half_width, batch_size, number_of_batches = (
+        queuing_time_batches_dn.confidence_interval())
+
+    print (f"Mean queuing time : {batch_mean:.2f} +/- {half_width:.2f} " +
+           f"(half width from {number_of_batches} batch means of " +
+           f"{batch_size} patients)")
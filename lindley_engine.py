@@ -0,0 +1,104 @@
+# FAST PATH FOR SINGLE SERVER FIFO CLINICS
+# When there's just one server (e.g. one nurse) and patients are seen in the
+# order they arrive (FIFO - First In First Out), we don't need to step
+# through the simulation event by event to work out how long each patient
+# queued for.  The Lindley recursion tells us directly :
+#
+#     queue time of patient k+1 = max(0, queue time of patient k
+#                                         + service time of patient k
+#                                         - time between arrivals k and k+1)
+#
+# i.e. the next patient waits for whatever's left of the work in front of
+# them when they arrive, or not at all if the nurse is already free.
+#
+# Better still, if we add up (service time - inter-arrival time) for each
+# patient to get a running total X, then the queue time of each patient is
+# just X minus the lowest value X has reached so far.  Both the running total
+# and the running minimum are single NumPy calls, so we can work out the
+# queue times of every patient in every run at once, with no Python loops
+# over patients at all.
+#
+# The random numbers come from the same streams (and are used in the same
+# order) as in a SimPy model that uses an RNG_Context with an "arrivals" and
+# a "consultation" stream, so for the same master seed we get the same
+# patients with the same queuing times as the SimPy model - just much faster.
+
+import numpy as np
+import pandas as pd
+from rng_streams import RNG_Context
+
+# Function to calculate the queue time of every patient, given the time
+# between each patient's arrival and the next one, and each patient's
+# service time.  Each row of the arrays is a separate run
+def lindley_queue_times(interarrival_times, service_times):
+    # The running total X starts at 0 for the first patient, and then goes up
+    # by (service time - inter-arrival time) for each patient after that
+    increments = service_times[:, :-1] - interarrival_times[:, :-1]
+    running_total = np.zeros(service_times.shape)
+    np.cumsum(increments, axis=1, out=running_total[:, 1:])
+
+    # The lowest value so far can't be above 0, as X started at 0
+    running_minimum = np.minimum.accumulate(running_total, axis=1)
+
+    return running_total - running_minimum
+
+# Function to simulate a number of runs of a single server FIFO clinic with
+# exponential inter-arrival and service times.  The first patient arrives at
+# time 0.  Patients whose queue ends (i.e. who start being seen) after the
+# warm up period and before the end of the run are counted, as they would
+# be in the SimPy model.  Returns a DataFrame with the mean queue time and
+# the number of patients seen in each run
+def simulate_single_server_fifo(mean_inter, mean_service, sim_duration,
+                                number_of_runs, warm_up_duration=0,
+                                master_seed=42, arrival_stream="arrivals",
+                                service_stream="consultation"):
+    run_duration = sim_duration + warm_up_duration
+
+    # Start with enough patients to cover the run in nearly every case, and
+    # double this if any run ends up with its last patient arriving before
+    # the end of the run
+    number_of_patients = int(run_duration / mean_inter
+                             + 6 * np.sqrt(run_duration / mean_inter) + 10)
+
+    while True:
+        interarrival_times = np.empty((number_of_runs, number_of_patients))
+        service_times = np.empty((number_of_runs, number_of_patients))
+
+        for run in range(number_of_runs):
+            rng = RNG_Context(master_seed, run)
+
+            arrivals = np.random.Generator(
+                np.random.PCG64(rng.seed_for_stream(arrival_stream)))
+            services = np.random.Generator(
+                np.random.PCG64(rng.seed_for_stream(service_stream)))
+
+            interarrival_times[run] = (
+                arrivals.standard_exponential(number_of_patients)
+                * mean_inter)
+            service_times[run] = (
+                services.standard_exponential(number_of_patients)
+                * mean_service)
+
+        arrival_times = np.zeros(interarrival_times.shape)
+        np.cumsum(interarrival_times[:, :-1], axis=1,
+                  out=arrival_times[:, 1:])
+
+        if (arrival_times[:, -1] >= run_duration).all():
+            break
+
+        number_of_patients *= 2
+
+    queue_times = lindley_queue_times(interarrival_times, service_times)
+    end_queue_times = arrival_times + queue_times
+
+    counted = ((end_queue_times >= warm_up_duration) &
+               (end_queue_times < run_duration))
+    patients_seen = counted.sum(axis=1)
+
+    with np.errstate(invalid="ignore"):
+        mean_queue_times = (np.where(counted, queue_times, 0).sum(axis=1)
+                            / patients_seen)
+
+    return pd.DataFrame({"Run":np.arange(number_of_runs),
+                         "Mean_Q_Time":mean_queue_times,
+                         "Patients_Seen":patients_seen})
@@ -31,7 +31,7 @@
 
 import simpy
 import random
-from statistics import mean
+from online_statistics import Welford_Accumulator
 import csv
 import pandas as pd
 
@@ -61,7 +61,7 @@ def patient_generator_test(env, t_inter, mean_test, nurse):
 
 # Activity generator function for weight loss consultation
 def activity_generator_weight_loss(env, mean_consult, nurse):
-    global list_of_queuing_times_nurse
+    global queuing_time_stats_nurse
     global warm_up_period
 
     time_entered_queue_for_nurse_wl = env.now
@@ -73,10 +73,10 @@ def activity_generator_weight_loss(env, mean_consult, nurse):
         time_in_queue_for_nurse_wl = (time_left_queue_for_nurse_wl - 
                                    time_entered_queue_for_nurse_wl)
 
-        # Now we only add this result to the list of results if the warm
-        # up period has passed
+        # Now we only add this result to the statistics if the warm up
+        # period has passed
         if env.now > warm_up_period:
-            list_of_queuing_times_nurse.append(time_in_queue_for_nurse_wl)
+            queuing_time_stats_nurse.update(time_in_queue_for_nurse_wl)
 
         sampled_consultation_time = random.expovariate(1.0/mean_consult)
 
@@ -85,7 +85,7 @@ def activity_generator_weight_loss(env, mean_consult, nurse):
 # Activity generator function for tests. Note - the resource we're requesting
 # here is the same resource as for the other activity - the nurse
 def activity_generator_test(env, mean_test, nurse):
-    global list_of_queuing_times_nurse
+    global queuing_time_stats_nurse
     global warm_up_period
 
     time_entered_queue_for_nurse_t = env.now
@@ -97,10 +97,10 @@ def activity_generator_test(env, mean_test, nurse):
         time_in_queue_for_nurse_t = (time_left_queue_for_nurse_t - 
                                      time_entered_queue_for_nurse_t)
         
-        # Now we only add this result to the list of results if the warm
-        # up period has passed
+        # Now we only add this result to the statistics if the warm up
+        # period has passed
         if env.now > warm_up_period:
-            list_of_queuing_times_nurse.append(time_in_queue_for_nurse_t)
+            queuing_time_stats_nurse.update(time_in_queue_for_nurse_t)
 
         sampled_test_time = random.expovariate(1.0 / mean_test)
 
@@ -135,8 +135,8 @@ for run in range(number_of_simulation_runs):
     mean_consult = 10
     mean_test = 3
 
-    # Set up a list to store queuing times for the nurse
-    list_of_queuing_times_nurse = []
+    # Set up an accumulator to keep statistics on queuing times for the nurse
+    queuing_time_stats_nurse = Welford_Accumulator()
 
     # Start the patients arrivals generators (we've got two to start this time)
     env.process(patient_generator_weight_loss(env, wl_inter, mean_consult, nurse))
@@ -146,7 +146,7 @@ for run in range(number_of_simulation_runs):
     env.run(until=(results_collection_period + warm_up_period))
 
     # Calculate and print mean queuing time for the nurse
-    mean_queuing_time_nurse = mean(list_of_queuing_times_nurse)
+    mean_queuing_time_nurse = queuing_time_stats_nurse.mean
     print(f"Mean queuing time for nurse (mins): {mean_queuing_time_nurse:.2f}")
 
     # Set up list to write to file - here we'll store the run number alongside
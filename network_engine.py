@@ -0,0 +1,228 @@
+# LOCKSTEP ENGINE FOR THE ED NETWORK
+# The ED in oop_simpy_3_exercise.py always has the same structure :
+#
+#     Registration (1 receptionist) -> Triage (2 nurses) -> ED Assessment
+#                                                           (2 ED doctors)
+#                                                        or ACU Assessment
+#                                                           (1 ACU doctor)
+#
+# and at every step, patients are seen in the order they join the queue
+# (FCFS - First Come First Served).  For a network like this, we don't need to
+# step through the simulation event by event.  For each step, if we know when
+# each patient arrives there and how long they'll take, we can go through the
+# patients in the order they arrive, and give each one to whichever server
+# will be free first (this is the Kiefer-Wolfowitz recursion - all we need to
+# keep track of is the time each server will next be free).  The patient
+# starts being seen at the later of when they arrive and when that server is
+# free, and the server is then next free once they've been seen.  The times
+# patients leave one step are the times they arrive at the next.
+#
+# Rather than doing this for one run at a time, we do it for all of the runs
+# at once - the k-th patient to arrive at a step in every run is dealt with in
+# the same NumPy operation.  So the Python loop is only over patients, and
+# thousands of runs take about the same time as one.
+#
+# The random numbers come from the same RNG_Context streams as the SimPy
+# model, used in the same order (e.g. the k-th ED assessment time sampled is
+# for the k-th patient to reach the ED assessment queue), so for the same
+# master seed, this gives the same patients with the same queuing times as
+# ED_Model in oop_simpy_3_exercise.py.
+
+import numpy as np
+import pandas as pd
+from rng_streams import RNG_Context
+from arrival_process import Piecewise_Arrival_Process
+from quantile_sketch import Quantile_Sketch
+
+# Function to sample a block of random numbers for each run from the named
+# stream, in the same way as a Block_Stream would.  Returns an array with one
+# row per run
+def sample_streams(master_seed, number_of_runs, stream_name, size,
+                   uniform=False):
+    samples = np.empty((number_of_runs, size))
+
+    for run in range(number_of_runs):
+        generator = np.random.Generator(np.random.PCG64(
+            RNG_Context(master_seed, run).seed_for_stream(stream_name)))
+
+        if uniform:
+            samples[run] = generator.random(size)
+        else:
+            samples[run] = generator.standard_exponential(size)
+
+    return samples
+
+# Function to simulate one step (a multi-server FCFS queue) for every run at
+# once.  It's given the time each patient arrives at the step (infinity for
+# patients that don't go to this step), the service times to hand out in
+# the order patients arrive, and the number of servers.  It returns the time
+# each patient starts being seen, and the time they finish
+def simulate_step(arrival_times, service_times, number_of_servers):
+    number_of_runs, number_of_patients = arrival_times.shape
+    runs = np.arange(number_of_runs)
+
+    # Put the patients in each run in the order they arrive at this step.
+    # Patients that don't come here have an arrival time of infinity, so they
+    # go to the end, after every patient that does come here
+    order = np.argsort(arrival_times, axis=1, kind="stable")
+    sorted_arrival_times = np.take_along_axis(arrival_times, order, axis=1)
+
+    sorted_start_times = np.empty(arrival_times.shape)
+    server_free_times = np.zeros((number_of_runs, number_of_servers))
+
+    for k in range(number_of_patients):
+        arrival_time = sorted_arrival_times[:, k]
+
+        server = server_free_times.argmin(axis=1)
+        start_time = np.maximum(arrival_time,
+                                server_free_times[runs, server])
+
+        server_free_times[runs, server] = start_time + service_times[:, k]
+        sorted_start_times[:, k] = start_time
+
+    # Put the results back in to patient order
+    start_times = np.empty(arrival_times.shape)
+    np.put_along_axis(start_times, order, sorted_start_times, axis=1)
+
+    end_times = np.empty(arrival_times.shape)
+    np.put_along_axis(end_times, order,
+                      sorted_start_times + service_times, axis=1)
+
+    return start_times, end_times
+
+# Function to simulate a number of runs of the ED model, with the parameters
+# given by params (e.g. the g class).  Returns a DataFrame of patient level
+# results with the same columns as ED_Model's results_df, plus a Run column,
+# for the patients whose journey ends after the warm up period and before
+# the end of the run (in the order their journeys ended, as in the SimPy
+# model)
+def simulate_ed_network(params, number_of_runs, master_seed=42,
+                        warm_up_duration=None):
+    if warm_up_duration is None:
+        warm_up_duration = params.warm_up_duration
+
+    run_duration = params.sim_duration + warm_up_duration
+
+    # Start with enough patients to cover the run in nearly every case, and
+    # double this if any run ends up with its last patient arriving before
+    # the end of the run.  Patients arriving after the end of the run can't
+    # affect anyone who arrived before them, so they don't change the results
+    ed_arrival_rates = getattr(params, "ed_arrival_rates", None)
+
+    if ed_arrival_rates is None:
+        mean_arrivals = run_duration / params.ed_inter
+    else:
+        ed_arrival_process = Piecewise_Arrival_Process(
+            [rate / 60 for rate in ed_arrival_rates], 60)
+        mean_arrivals = ed_arrival_process.cumulative_intensity(run_duration)
+
+    number_of_patients = int(mean_arrivals + 6 * np.sqrt(mean_arrivals) + 10)
+
+    while True:
+        standard_exponentials = sample_streams(
+            master_seed, number_of_runs, "arrivals", number_of_patients)
+
+        # The first patient arrives at the start of the run, and each random
+        # number gives the time to the next one (at a constant rate, or
+        # following the table of arrival rates)
+        arrival_times = np.zeros(standard_exponentials.shape)
+
+        if ed_arrival_rates is None:
+            np.cumsum(params.ed_inter * standard_exponentials[:, :-1], axis=1,
+                      out=arrival_times[:, 1:])
+        else:
+            arrival_times[:, 1:] = ed_arrival_process.arrival_times(
+                standard_exponentials[:, :-1])
+
+        if (arrival_times[:, -1] >= run_duration).all():
+            break
+
+        number_of_patients *= 2
+
+    # Function to get the service times for a step
+    def service_times(stream_name, mean):
+        return mean * sample_streams(master_seed, number_of_runs, stream_name,
+                                     number_of_patients)
+
+    acu_patient = sample_streams(master_seed, number_of_runs, "routing",
+                                 number_of_patients,
+                                 uniform=True) < params.prob_acu
+
+    start_reg, end_reg = simulate_step(
+        arrival_times, service_times("registration", params.mean_register),
+        params.number_of_receptionists)
+
+    start_triage, end_triage = simulate_step(
+        end_reg, service_times("triage", params.mean_triage),
+        params.number_of_nurses)
+
+    start_ed, end_ed = simulate_step(
+        np.where(acu_patient, np.inf, end_triage),
+        service_times("ed_assessment", params.mean_ed_assess),
+        params.number_of_ed_doctors)
+
+    start_acu, end_acu = simulate_step(
+        np.where(acu_patient, end_triage, np.inf),
+        service_times("acu_assessment", params.mean_acu_assess),
+        params.number_of_acu_doctors)
+
+    end_journey = np.where(acu_patient, end_acu, end_ed)
+    stored = ((end_journey > warm_up_duration) &
+              (end_journey < run_duration))
+
+    runs, patients = np.nonzero(stored)
+    results_df = pd.DataFrame({
+        "Run":runs,
+        "P_ID":patients + 1,
+        "Q_Time_Registration":(start_reg - arrival_times)[stored],
+        "Q_Time_Triage":(start_triage - end_reg)[stored],
+        "Q_Time_ED_Assessment":np.where(acu_patient, np.nan,
+                                        start_ed - end_triage)[stored],
+        "Q_Time_ACU_Assessment":np.where(acu_patient,
+                                         start_acu - end_triage,
+                                         np.nan)[stored],
+        "End_Time":end_journey[stored]})
+
+    results_df = (results_df.sort_values(["Run", "End_Time"], kind="stable")
+                  .set_index("P_ID"))
+
+    return results_df
+
+# Function to turn the patient level results from simulate_ed_network into
+# one row per run, with the same columns as ED_Model.get_run_summary() -
+# including the saved state of a quantile sketch of each queue's queuing
+# times, filled in the order the patients' journeys ended (as in ED_Model,
+# so the sketches are the same too)
+def summarise_ed_network_runs(results_df, number_of_runs):
+    run_means = (results_df.drop(columns="End_Time").groupby("Run").mean()
+                 .reindex(range(number_of_runs)))
+
+    q_time_columns = ["Q_Time_Registration",
+                      "Q_Time_Triage",
+                      "Q_Time_ED_Assessment",
+                      "Q_Time_ACU_Assessment"]
+    run_results = dict(tuple(results_df.groupby("Run")))
+    q_time_sketches = []
+
+    for run in range(number_of_runs):
+        sketches = {column:Quantile_Sketch() for column in q_time_columns}
+
+        if run in run_results:
+            for column in q_time_columns:
+                values = run_results[run][column].values
+
+                # Patients who didn't go through a queue have NaN for it
+                for value in values[~np.isnan(values)].tolist():
+                    sketches[column].update(value)
+
+        q_time_sketches.append({name:sketch.to_dict() for name, sketch
+                                in sketches.items()})
+
+    return pd.DataFrame({
+        "Run":range(number_of_runs),
+        "Mean_Q_Time_Registration":run_means["Q_Time_Registration"].values,
+        "Mean_Q_Time_Triage":run_means["Q_Time_Triage"].values,
+        "Mean_Q_Time_ED_Assessment":run_means["Q_Time_ED_Assessment"].values,
+        "Mean_Q_Time_ACU_Assessment":(
+            run_means["Q_Time_ACU_Assessment"].values),
+        "Q_Time_Sketches":q_time_sketches})
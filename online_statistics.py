@@ -0,0 +1,123 @@
+# ONLINE STATISTICS
+# Appending every queuing time to a list and taking the mean at the end means
+# the list keeps growing for as long as the simulation runs.  But to get the
+# mean (and the variance, min and max) we don't actually need to keep every
+# value - we can keep a handful of running totals, and update them each time
+# a new value comes in.  Welford's method does this for the mean and variance
+# in a way that stays accurate even for very long runs.
+#
+# Two accumulators can also be merged (e.g. the results from two runs, or
+# from two worker processes), giving exactly the same answer as if every
+# value had gone in to a single accumulator.
+#
+# We can also count how many values breach a threshold - e.g. how many
+# patients queued for longer than a 30 minute target.
+
+import math
+
+# Class to keep running statistics for a single metric
+class Welford_Accumulator:
+    def __init__(self, sla_threshold=None):
+        self.sla_threshold = sla_threshold
+
+        self.count = 0
+        self.mean = float("nan")
+        self.sum_of_squared_differences = 0.0
+        self.min = float("nan")
+        self.max = float("nan")
+        self.breaches = 0
+
+    # Method to add a new value
+    def update(self, value):
+        self.count += 1
+
+        if self.count == 1:
+            self.mean = value
+            self.min = value
+            self.max = value
+        else:
+            difference = value - self.mean
+            self.mean += difference / self.count
+            self.sum_of_squared_differences += difference * (value - self.mean)
+
+            if value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+        if self.sla_threshold is not None and value > self.sla_threshold:
+            self.breaches += 1
+
+    # Method to merge another accumulator for the same metric in to this one
+    # (using Chan et al's method for combining variances)
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count = other.count
+            self.mean = other.mean
+            self.sum_of_squared_differences = other.sum_of_squared_differences
+            self.min = other.min
+            self.max = other.max
+            self.breaches = other.breaches
+            return self
+
+        count = self.count + other.count
+        difference = other.mean - self.mean
+
+        self.mean += difference * other.count / count
+        self.sum_of_squared_differences += (
+            other.sum_of_squared_differences
+            + difference**2 * self.count * other.count / count)
+        self.count = count
+
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.breaches += other.breaches
+
+        return self
+
+    # The sample variance (the same as statistics.variance would give)
+    @property
+    def variance(self):
+        if self.count < 2:
+            return float("nan")
+
+        return self.sum_of_squared_differences / (self.count - 1)
+
+    @property
+    def stdev(self):
+        return math.sqrt(self.variance)
+
+    # The proportion of values that breached the SLA threshold
+    @property
+    def breach_rate(self):
+        if self.count == 0:
+            return float("nan")
+
+        return self.breaches / self.count
+
+    # Methods to save the state of the accumulator as a dictionary (e.g. to
+    # send it back from a worker process), and to create an accumulator from
+    # a saved state
+    def to_dict(self):
+        return {"sla_threshold":self.sla_threshold,
+                "count":self.count,
+                "mean":self.mean,
+                "sum_of_squared_differences":self.sum_of_squared_differences,
+                "min":self.min,
+                "max":self.max,
+                "breaches":self.breaches}
+
+    @classmethod
+    def from_dict(cls, state):
+        accumulator = cls(state["sla_threshold"])
+        accumulator.count = state["count"]
+        accumulator.mean = state["mean"]
+        accumulator.sum_of_squared_differences = (
+            state["sum_of_squared_differences"])
+        accumulator.min = state["min"]
+        accumulator.max = state["max"]
+        accumulator.breaches = state["breaches"]
+
+        return accumulator
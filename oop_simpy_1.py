@@ -77,6 +77,10 @@ class g:
 # Class representing our patients coming in for the weight loss clinic.
 # Here, we only have a constructor method, that sets up the patient's ID
 class Weight_Loss_Patient:
+    # __slots__ stores the ID in a fixed slot rather than in a dictionary
+    # belonging to each patient, so each patient takes up less memory
+    __slots__ = ("id",)
+    
     def __init__(self, p_id):
         self.id = p_id
         
@@ -62,9 +62,13 @@
 #
 
 import simpy
-import random
 import pandas as pd
 import csv
+from results_recorder import Results_Recorder
+from rng_streams import RNG_Context
+from arrival_process import Piecewise_Arrival_Process
+from scenario import Scenario
+from lindley_engine import simulate_single_server_fifo
 
 # Class to store global parameter values.  We don't create an instance of this
 # class - we just refer to the class blueprint itself to access the numbers
@@ -76,10 +80,30 @@ class g:
     sim_duration = 120
     number_of_runs = 100
     
+    # Set wl_arrival_rates to a table of the mean number of patients arriving
+    # in each hour (repeating once the end of the table is reached) to make
+    # arrivals follow it, instead of arriving every wl_inter minutes on
+    # average (see arrival_process.py)
+    wl_arrival_rates = None
+    
+    master_seed = 42
+    
+    # With a single nurse seeing patients in the order they arrive, we can use
+    # the much faster "lindley" engine instead of stepping through the
+    # simulation in SimPy.  Both give the same results for the same seed.
+    # The lindley engine only models a single nurse, and needs a constant
+    # arrival rate, so we always use SimPy if number_of_nurses is more than
+    # 1 or wl_arrival_rates is set
+    engine = "simpy"
+    
 # Class representing our patients coming in for the weight loss clinic.
 # This time we've added another attribute, that will store the calculated
 # queuing time for the nurse for each patient (each instance of this class)
 class Weight_Loss_Patient:
+    # With __slots__, the attributes are kept in fixed slots instead of a
+    # dictionary per patient, so patients are smaller and quicker to create
+    __slots__ = ("id", "q_time_nurse")
+    
     def __init__(self, p_id):
         self.id = p_id
         self.q_time_nurse = 0
@@ -94,22 +118,45 @@ class GP_Surgery_Model:
     # attribute storing the run number, which gets passed in to the instance
     # of the class when it's instantiated, and an attribute to store the mean
     # queuing time for the nurse across patients in this run of the model.
-    def __init__(self, run_number):
+    def __init__(self, run_number, master_seed=None, scenario=None):
         self.env = simpy.Environment()
         self.patient_counter = 0
         
-        self.nurse = simpy.Resource(self.env, capacity=g.number_of_nurses)
+        # The model reads its parameters from its own scenario (see
+        # scenario.py), which is made from the g class if we don't give it
+        # one, so models with different parameters can run side by side
+        if scenario is None:
+            scenario = Scenario.from_class(g)
+        self.scenario = scenario
+        
+        # Each run gets its own random number streams, seeded from the master
+        # seed and the run number
+        if master_seed is None:
+            master_seed = self.scenario.master_seed
+        self.rng = RNG_Context(master_seed, run_number)
+        
+        # Patients arrive at a constant rate, unless the scenario has a table
+        # of hourly arrival rates for them to follow
+        self.wl_arrival_process = None
+        if self.scenario.wl_arrival_rates is not None:
+            self.wl_arrival_process = Piecewise_Arrival_Process(
+                [rate / 60 for rate in self.scenario.wl_arrival_rates], 60)
+        
+        self.nurse = simpy.Resource(self.env,
+                                    capacity=self.scenario.number_of_nurses)
         
         self.run_number = run_number
         
         self.mean_q_time_nurse = 0
         
+        # Patient level results are stored in a results recorder as the run
+        # goes on, and turned into the results_df DataFrame once, at the end
+        # of the run
+        self.results = Results_Recorder("P_ID",
+                                        ["Start_Q_Nurse",
+                                         "End_Q_Nurse",
+                                         "Q_Time_Nurse"])
         self.results_df = pd.DataFrame()
-        self.results_df["P_ID"] = []
-        self.results_df["Start_Q_Nurse"] = []
-        self.results_df["End_Q_Nurse"] = []
-        self.results_df["Q_Time_Nurse"] = []
-        self.results_df.set_index("P_ID", inplace=True)
 
     # A method that generates patients arriving for the weight loss clinic
     def generate_wl_arrivals(self):
@@ -128,8 +175,16 @@ class GP_Surgery_Model:
             self.env.process(self.attend_wl_clinic(wp))
             
             # Randomly sample the time to the next patient arriving for the
-            # weight loss clinic.  The mean is stored in the g class.
-            sampled_interarrival = random.expovariate(1.0 / g.wl_inter)
+            # weight loss clinic.  The mean is stored in the g class (or the
+            # arrival rates, if we've given a table of them).
+            if self.wl_arrival_process is None:
+                sampled_interarrival = self.rng.stream(
+                    "arrivals").expovariate(1.0 / self.scenario.wl_inter)
+            else:
+                sampled_interarrival = (
+                    self.wl_arrival_process.interarrival_time(
+                        self.env.now,
+                        self.rng.stream("arrivals").standard_exponential()))
             
             # Freeze this function until that time has elapsed
             yield self.env.timeout(sampled_interarrival)
@@ -154,18 +209,17 @@ class GP_Surgery_Model:
             patient.q_time_nurse = end_q_nurse - start_q_nurse
             
             # Store the start and end queue times alongside the patient ID in
-            # the Pandas DataFrame of the GP_Surgery_Model class
-            df_to_add = pd.DataFrame({"P_ID":[patient.id],
-                                      "Start_Q_Nurse":[start_q_nurse],
-                                      "End_Q_Nurse":[end_q_nurse],
-                                      "Q_Time_Nurse":[patient.q_time_nurse]})
-            df_to_add.set_index("P_ID", inplace=True)
-            # self.results_df = self.results_df.append(df_to_add)
-            self.results_df = pd.concat([self.results_df, df_to_add])
+            # the results recorder of the GP_Surgery_Model class
+            self.results.record(patient.id,
+                                Start_Q_Nurse=start_q_nurse,
+                                End_Q_Nurse=end_q_nurse,
+                                Q_Time_Nurse=patient.q_time_nurse)
             
             # Randomly sample the time the patient will spend in consultation
             # with the nurse.  The mean is stored in the g class.
-            sampled_cons_duration = random.expovariate(1.0 / g.mean_consult)
+            sampled_cons_duration = (
+                self.rng.stream("consultation").expovariate(
+                    1.0 / self.scenario.mean_consult))
             
             # Freeze this function until that time has elapsed
             yield self.env.timeout(sampled_cons_duration)
@@ -173,7 +227,7 @@ class GP_Surgery_Model:
     # A method that calculates the average queuing time for the nurse.  We can
     # call this at the end of each run
     def calculate_mean_q_time_nurse(self):
-        self.mean_q_time_nurse = self.results_df["Q_Time_Nurse"].mean()
+        self.mean_q_time_nurse = self.results.mean("Q_Time_Nurse")
 
     # A method to write run results to file.  Here, we write the run number
     # against the the calculated mean queuing time for the nurse across
@@ -185,22 +239,30 @@ class GP_Surgery_Model:
                                 self.mean_q_time_nurse]
             writer.writerow(results_to_write)
     
+    # A method to return a dictionary summarising the run (this is what gets
+    # sent back when the run is carried out by a worker, e.g. in a scenario
+    # sweep)
+    def get_run_summary(self):
+        return {"Run":self.run_number,
+                "Mean_Q_Time_Nurse":self.mean_q_time_nurse}
+    
     # The run method starts up the entity generators, and tells SimPy to start
-    # running the environment for the duration specified in the g class. After
-    # the simulation has run, it calls the methods that calculate run
-    # results, and the method that writes these results to file
+    # running the environment for the duration specified in the scenario.
+    # After the simulation has run, it calls the methods that calculate run
+    # results.  Writing the results to file is left to whoever started the
+    # run, so that runs carried out by workers don't all write to the same
+    # file
     def run(self):
         # Start entity generators
         self.env.process(self.generate_wl_arrivals())
         
         # Run simulation
-        self.env.run(until=g.sim_duration)
+        self.env.run(until=self.scenario.sim_duration)
         
-        # Calculate run results
+        # Store the patient level results in a DataFrame, and calculate run
+        # results
+        self.results_df = self.results.to_dataframe()
         self.calculate_mean_q_time_nurse()
-        
-        # Write run results to file
-        self.write_run_results()
 
 # Class to store, calculate and manipulate trial results in a Pandas DataFrame
 class Trial_Results_Calculator:
@@ -226,23 +288,39 @@ class Trial_Results_Calculator:
                f"{trial_mean_q_time_nurse:.2f}")
 
 # Everything above is definition of classes and functions, but here's where
-# the code will start actively doing things.        
-
-# Create a file to store trial results, and write the column headers
-with open("trial_results.csv", "w") as f:
-    writer = csv.writer(f, delimiter=",")
-    column_headers = ["Run", "Mean_Q_Time_Nurse"]
-    writer.writerow(column_headers)
+# the code will start actively doing things.  This sits inside the if block
+# below so that other files (e.g. scenario sweeps) can import the
+# GP_Surgery_Model class without starting a trial
+if __name__ == "__main__":
+    # Create a file to store trial results, and write the column headers
+    with open("trial_results.csv", "w") as f:
+        writer = csv.writer(f, delimiter=",")
+        column_headers = ["Run", "Mean_Q_Time_Nurse"]
+        writer.writerow(column_headers)
 
-# For the number of runs specified in the g class, create an instance of the
-# GP_Surgery_Model class, and call its run method
-for run in range(g.number_of_runs):
-    print (f"Run {run+1} of {g.number_of_runs}")
-    my_gp_model = GP_Surgery_Model(run)
-    my_gp_model.run()
-    print ()
+    # For the number of runs specified in the g class, create an instance of
+    # the GP_Surgery_Model class, call its run method, and write its results
+    # to file.  Or, if we're using the lindley engine, work out the results of
+    # every run at once and write them to file
+    if (g.engine == "lindley" and g.number_of_nurses == 1 and
+            g.wl_arrival_rates is None):
+        lindley_results_df = simulate_single_server_fifo(
+            g.wl_inter, g.mean_consult, g.sim_duration, g.number_of_runs,
+            master_seed=g.master_seed)
+    
+        with open("trial_results.csv", "a") as f:
+            writer = csv.writer(f, delimiter=",")
+            writer.writerows(lindley_results_df[["Run", "Mean_Q_Time"]]
+                             .itertuples(index=False))
+    else:
+        for run in range(g.number_of_runs):
+            print (f"Run {run+1} of {g.number_of_runs}")
+            my_gp_model = GP_Surgery_Model(run)
+            my_gp_model.run()
+            my_gp_model.write_run_results()
+            print ()
 
-# Once the trial is complete, we'll create an instance of the
-# Trial_Result_Calculator class and run the print_trial_results method
-my_trial_results_calculator = Trial_Results_Calculator()
-my_trial_results_calculator.print_trial_results()
\ No newline at end of file
+    # Once the trial is complete, we'll create an instance of the
+    # Trial_Result_Calculator class and run the print_trial_results method
+    my_trial_results_calculator = Trial_Results_Calculator()
+    my_trial_results_calculator.print_trial_results()
\ No newline at end of file
@@ -89,9 +89,21 @@
 # -*- coding: utf-8 -*-
 
 import simpy
-import random
 import pandas as pd
-import csv
+from replication_runner import (run_replications, run_until_precision,
+                                run_forked_replications)
+from results_recorder import Results_Recorder
+from rng_streams import RNG_Context
+from patience import Patience_Monitor
+from skill_pool import Skill_Pool
+from arrival_process import Piecewise_Arrival_Process
+from scenario import Scenario
+from result_cache import Result_Cache
+from trial_results_sink import Trial_Results_Sink
+from warm_up_analysis import Warm_Up_Analyser
+from quantile_sketch import Quantile_Sketch, merge_sketch_states
+from network_engine import simulate_ed_network, summarise_ed_network_runs
+from scenario_sweep import scenario_grid, run_sweep
 
 # Class to store global parameter values.  We don't create an instance of this
 # class - we just refer to the class blueprint itself to access the numbers
@@ -110,14 +122,102 @@ class g:
     number_of_ed_doctors = 2
     number_of_acu_doctors = 1
     
+    # Set number_of_cross_cover_doctors to add doctors who can do both ED and
+    # ACU assessments, on top of the ED and ACU doctors.  All of the doctors
+    # are then a single pool, where each patient is seen by the first free
+    # doctor who can see them (see skill_pool.py)
+    number_of_cross_cover_doctors = 0
+    
     sim_duration = 2880
     warm_up_duration = 1440
     number_of_runs = 100
     
+    # Set ed_arrival_rates to a table of the mean number of patients arriving
+    # in each hour (e.g. 24 for the hours of a day, or 168 for the hours of
+    # a week), starting from the start of the run and repeating once the
+    # end of the table is reached, to make arrivals follow it instead of
+    # arriving every ed_inter minutes on average (see arrival_process.py)
+    ed_arrival_rates = None
+    
+    # Set mean_patience to make patients give up waiting (renege) and leave
+    # if they've waited longer than their patience, which is sampled from an
+    # exponential distribution with the given mean for each stage, e.g.
+    # {"ED_Assessment":240}.  Set balk_threshold to make patients leave
+    # rather than join a queue (balk) if that many people are already
+    # waiting in it, e.g. {"Registration":20}.  The stages are
+    # "Registration", "Triage", "ED_Assessment" and "ACU_Assessment"
+    mean_patience = None
+    balk_threshold = None
+    
+    master_seed = 42
+    number_of_workers = None
+    
+    # Set target_precision to e.g. 0.05 to keep doing runs until the
+    # confidence interval for every mean queuing time is within 5% of the
+    # mean (but at least min_runs and at most max_runs runs), instead of
+    # doing number_of_runs runs
+    target_precision = None
+    confidence = 0.95
+    min_runs = 10
+    max_runs = 1000
+    
+    # The file the results of each run are written to.  Use a .arrow or
+    # .parquet extension instead of .csv to write a columnar binary file
+    trial_results_file = "trial_ed_results.csv"
+    
+    # Set auto_warm_up to True to use pilot runs to work out how long the
+    # warm up needs to be (see warm_up_analysis.py), instead of using
+    # warm_up_duration.  The answer is cached in warm_up_cache.json, so the
+    # pilot runs only need doing once for each set of parameters
+    auto_warm_up = False
+    number_of_pilot_runs = 10
+    
+    # Set fork_after_warm_up to True to simulate the warm up only once, and
+    # branch every run off from the end of it (see run_forked_replications in
+    # replication_runner.py), rather than each run simulating its own warm up.
+    # This always does number_of_runs runs, so it can't be used with
+    # target_precision.  The runs all start from the same warm up, so they
+    # give different results to ordinary runs with the same run numbers, and
+    # aren't saved in or looked up from the result cache.  It isn't used
+    # with the lockstep engine, which never simulates a warm up run by run
+    fork_after_warm_up = False
+    
+    # Set result_cache_directory to e.g. "result_cache" to save the results
+    # of every run there, and look them up instead of simulating the same run
+    # again (see result_cache.py).  The cache isn't used for runs branched
+    # off a single warm up (fork_after_warm_up), or by the lockstep
+    # engine
+    result_cache_directory = None
+    
+    # To compare several scenarios at once, set sweep_parameters to the
+    # values to try for each parameter, e.g.
+    # {"number_of_ed_doctors":[2, 3, 4], "number_of_nurses":[1, 2]}.  Every
+    # combination is run number_of_runs times (see scenario_sweep.py), and
+    # the results of every run are written to sweep_results_file
+    sweep_parameters = None
+    sweep_results_file = "sweep_ed_results.csv"
+    
+    # As every queue here is first come first served, we can use the much
+    # faster "lockstep" engine, which works out every run at once, instead of
+    # stepping through each run in SimPy.  Both give the same results for the
+    # same seed.  The lockstep engine always does number_of_runs runs, and
+    # can't have patients leaving queues or cross cover doctors, so if
+    # mean_patience, balk_threshold or number_of_cross_cover_doctors are
+    # set, we always use SimPy
+    engine = "simpy"
+    
 # Class representing our patients coming in to the ED.  Here, we'll store a
 # patient ID and whether the patient will be sent to the ACU or stay in the
 # ED, along with a method that makes that determination randomly
 class ED_Patient:
+    # Listing the attributes in __slots__ means each patient stores them in
+    # fixed slots, rather than in a dictionary of its own, which makes each
+    # patient much smaller and quicker to create.  It does mean we can't add
+    # any attributes that aren't listed here
+    __slots__ = ("id", "prob_acu", "acu_patient",
+                 "q_time_reg", "q_time_triage",
+                 "q_time_ed_assess", "q_time_acu_assess")
+    
     def __init__(self, p_id, prob_acu):
         self.id = p_id
         self.prob_acu = prob_acu
@@ -129,25 +229,67 @@ class ED_Patient:
         self.q_time_acu_assess = 0
         
     # Method to determine whether or not this patient will be diverted to the
-    # ACU, based on their probability of being an ACU patient
-    def determine_acu_destiny(self):
-        if random.uniform(0, 1) < self.prob_acu:
+    # ACU, based on their probability of being an ACU patient.  The random
+    # numbers come from the stream passed in (the model's routing stream)
+    def determine_acu_destiny(self, rng):
+        if rng.uniform(0, 1) < self.prob_acu:
             self.acu_patient = True
             
 # Class representing our model of the ED
 class ED_Model:
-    def __init__(self, run_number):
+    def __init__(self, run_number, master_seed=None, warm_up_duration=None,
+                 scenario=None):
         self.env = simpy.Environment()
         self.patient_counter = 0
         
-        self.receptionist = simpy.Resource(self.env,
-                                           capacity=g.number_of_receptionists)
+        # The model reads its parameters from its own scenario (see
+        # scenario.py), which is made from the g class if we don't give it
+        # one, so models with different parameters can run side by side
+        if scenario is None:
+            scenario = Scenario.from_class(g)
+        self.scenario = scenario
+        
+        # Each run gets its own random number streams, seeded from the master
+        # seed and the run number, so any run can be repeated on its own
+        if master_seed is None:
+            master_seed = self.scenario.master_seed
+        self.rng = RNG_Context(master_seed, run_number)
+        
+        # The warm up duration defaults to the one in the scenario, but can be
+        # changed for this run (e.g. to 0 for a warm up analysis pilot run)
+        if warm_up_duration is None:
+            warm_up_duration = self.scenario.warm_up_duration
+        self.warm_up_duration = warm_up_duration
+        
+        # Patients arrive at a constant rate, unless the scenario has a table
+        # of hourly arrival rates for them to follow
+        self.ed_arrival_process = None
+        if self.scenario.ed_arrival_rates is not None:
+            self.ed_arrival_process = Piecewise_Arrival_Process(
+                [rate / 60 for rate in self.scenario.ed_arrival_rates], 60)
+        
+        self.receptionist = simpy.Resource(
+            self.env, capacity=self.scenario.number_of_receptionists)
         self.nurse = simpy.Resource(self.env,
-                                    capacity=g.number_of_nurses)
-        self.ed_doctor = simpy.Resource(self.env,
-                                        capacity=g.number_of_ed_doctors)
-        self.acu_doctor = simpy.Resource(self.env,
-                                         capacity=g.number_of_acu_doctors)
+                                    capacity=self.scenario.number_of_nurses)
+        
+        # With cross cover doctors, the ED and ACU patients queue for doctors
+        # with the skills they need from a single pool of doctors, which the
+        # model uses in the same way as separate resources
+        if self.scenario.number_of_cross_cover_doctors == 0:
+            self.ed_doctor = simpy.Resource(
+                self.env, capacity=self.scenario.number_of_ed_doctors)
+            self.acu_doctor = simpy.Resource(
+                self.env, capacity=self.scenario.number_of_acu_doctors)
+        else:
+            doctors = Skill_Pool(
+                self.env,
+                [{"ED"}] * self.scenario.number_of_ed_doctors +
+                [{"ACU"}] * self.scenario.number_of_acu_doctors +
+                [{"ED", "ACU"}] *
+                self.scenario.number_of_cross_cover_doctors)
+            self.ed_doctor = doctors.resource({"ED"})
+            self.acu_doctor = doctors.resource({"ACU"})
         
         self.run_number = run_number
         
@@ -156,13 +298,37 @@ class ED_Model:
         self.mean_q_time_ed_assessment = 0
         self.mean_q_time_acu_assessment = 0
         
+        # Patient level results are stored in a results recorder as the run
+        # goes on, and turned into the results_df DataFrame once, at the end
+        # of the run
+        self.results = Results_Recorder("P_ID",
+                                        ["Q_Time_Registration",
+                                         "Q_Time_Triage",
+                                         "Q_Time_ED_Assessment",
+                                         "Q_Time_ACU_Assessment",
+                                         "End_Time"])
         self.results_df = pd.DataFrame()
-        self.results_df["P_ID"] = []
-        self.results_df["Q_Time_Registration"] = []
-        self.results_df["Q_Time_Triage"] = []
-        self.results_df["Q_Time_ED_Assessment"] = []
-        self.results_df["Q_Time_ACU_Assessment"] = []
-        self.results_df.set_index("P_ID", inplace=True)
+        
+        # We also keep a quantile sketch of the queuing times for each queue,
+        # so we can work out percentiles over the whole trial without having
+        # to keep every patient's results from every run
+        self.q_time_sketches = {"Q_Time_Registration":Quantile_Sketch(),
+                                "Q_Time_Triage":Quantile_Sketch(),
+                                "Q_Time_ED_Assessment":Quantile_Sketch(),
+                                "Q_Time_ACU_Assessment":Quantile_Sketch()}
+        
+        # For patients who leave a queue without being seen (see join_queue),
+        # we count how many balked and reneged at each stage after the warm
+        # up, and add up how long those who reneged waited first.  A single
+        # patience monitor keeps track of everyone's patience
+        self.patience_monitor = Patience_Monitor(self.env)
+        self.abandonments = {stage:{"Balked":0,
+                                    "Reneged":0,
+                                    "Wait_Before_Reneging":0.0}
+                             for stage in ["Registration",
+                                           "Triage",
+                                           "ED_Assessment",
+                                           "ACU_Assessment"]}
         
     # A method that generates patients arriving at the ED
     def generate_ed_arrivals(self):
@@ -172,32 +338,87 @@ class ED_Model:
             self.patient_counter += 1
             
             # Create a new patient
-            p = ED_Patient(self.patient_counter, g.prob_acu)
+            p = ED_Patient(self.patient_counter, self.scenario.prob_acu)
             
             # Determine the patient's ACU destiny by running the appropriate
             # method
-            p.determine_acu_destiny()
+            p.determine_acu_destiny(self.rng.stream("routing"))
             
             # Get the SimPy environment to run the ed_patient_journey method 
             # with this patient
             self.env.process(self.ed_patient_journey(p))
             
-            # Randomly sample the time to the next patient arriving
-            sampled_interarrival = random.expovariate(1.0 / g.ed_inter)
+            # Randomly sample the time to the next patient arriving, either
+            # at a constant rate, or following the table of arrival rates
+            if self.ed_arrival_process is None:
+                sampled_interarrival = self.rng.stream(
+                    "arrivals").expovariate(1.0 / self.scenario.ed_inter)
+            else:
+                sampled_interarrival = (
+                    self.ed_arrival_process.interarrival_time(
+                        self.env.now,
+                        self.rng.stream("arrivals").standard_exponential()))
             
             # Freeze this function until that time has elapsed
             yield self.env.timeout(sampled_interarrival)
             
+    # A method for a patient to join the queue for a resource at a stage of
+    # their journey, and wait for the request to be met.  If too many people
+    # are already waiting, the patient balks (doesn't join the queue), and if
+    # their patience runs out first, they renege (leave the queue).  Either
+    # way, they leave the ED, and we get None back instead of the request
+    def join_queue(self, resource, stage):
+        balk_threshold = (self.scenario.balk_threshold or {}).get(stage)
+        mean_patience = (self.scenario.mean_patience or {}).get(stage)
+        
+        if (balk_threshold is not None and
+                len(resource.queue) >= balk_threshold):
+            self.record_abandonment(stage, "Balked")
+            return None
+        
+        req = resource.request()
+        
+        # Patients who don't have to wait don't need a patience
+        if mean_patience is None or req.triggered:
+            yield req
+            return req
+        
+        start_q = self.env.now
+        patience = self.rng.stream("patience").expovariate(
+            1.0 / mean_patience)
+        
+        yield self.patience_monitor.wait(req, patience)
+        
+        if req.triggered:
+            return req
+        
+        req.cancel()
+        self.record_abandonment(stage, "Reneged", self.env.now - start_q)
+        
+        return None
+    
+    # A method to count a patient leaving a queue without being seen, if the
+    # warm up time has passed
+    def record_abandonment(self, stage, how, wait=0.0):
+        if self.env.now > self.warm_up_duration:
+            self.abandonments[stage][how] += 1
+            
+            if how == "Reneged":
+                self.abandonments[stage]["Wait_Before_Reneging"] += wait
+    
     def ed_patient_journey(self, patient):
         """REGISTRATION"""
         # Record the time the patient started queuing for registration
         start_q_reg = self.env.now
         
-        # Request a receptionist
-        with self.receptionist.request() as req:
-            # Freeze the function until the request can be met
-            yield req
-            
+        # Request a receptionist, and freeze the function until the
+        # request can be met (unless the patient leaves instead)
+        req = yield from self.join_queue(self.receptionist,
+                                         "Registration")
+        if req is None:
+            return
+        
+        with req:
             # Record the time the patient finished queuing for registration
             end_q_reg = self.env.now
             
@@ -206,7 +427,9 @@ class ED_Model:
             patient.q_time_reg = end_q_reg - start_q_reg
             
             # Randomly sample the time the patient will spend being registered
-            sampled_reg_duration = random.expovariate(1.0 / g.mean_register)
+            sampled_reg_duration = (
+                self.rng.stream("registration").expovariate(
+                    1.0 / self.scenario.mean_register))
             
             # Freeze this function until that time has elapsed
             yield self.env.timeout(sampled_reg_duration)
@@ -215,11 +438,14 @@ class ED_Model:
         # Record the time the patient started queuing for triage
         start_q_triage = self.env.now
         
-        # Request a nurse
-        with self.nurse.request() as req:
-            # Freeze the function until the request can be met
-            yield req
-            
+        # Request a nurse, and freeze the function until the
+        # request can be met (unless the patient leaves instead)
+        req = yield from self.join_queue(self.nurse,
+                                         "Triage")
+        if req is None:
+            return
+        
+        with req:
             # Record the time the patient finished queuing for triage
             end_q_triage = self.env.now
             
@@ -228,7 +454,9 @@ class ED_Model:
             patient.q_time_triage = end_q_triage - start_q_triage
             
             # Randomly sample the time the patient will spend being triaged
-            sampled_triage_duration = random.expovariate(1.0 / g.mean_triage)
+            sampled_triage_duration = (
+                self.rng.stream("triage").expovariate(
+                    1.0 / self.scenario.mean_triage))
             
             # Freeze this function until that time has elapsed
             yield self.env.timeout(sampled_triage_duration)
@@ -241,11 +469,14 @@ class ED_Model:
             # Record the time the patient started queuing for ACU assessment
             start_q_acu_assess = self.env.now
             
-            # Request an ACU doctor
-            with self.acu_doctor.request() as req:
-                # Freeze the function until the request can be met
-                yield req
-                
+            # Request an ACU doctor, and freeze the function until the
+            # request can be met (unless the patient leaves instead)
+            req = yield from self.join_queue(self.acu_doctor,
+                                             "ACU_Assessment")
+            if req is None:
+                return
+            
+            with req:
                 # Record the time the patient finished queuing for ACU 
                 # assessment
                 end_q_acu_assess = self.env.now
@@ -258,7 +489,8 @@ class ED_Model:
                 # Randomly sample the time the patient will spend being 
                 # assessed
                 sampled_acu_assess_duration = (
-                    random.expovariate(1.0 / g.mean_acu_assess))
+                    self.rng.stream("acu_assessment").expovariate(
+                        1.0 / self.scenario.mean_acu_assess))
                 
                 # Freeze this function until that time has elapsed
                 yield self.env.timeout(sampled_acu_assess_duration)
@@ -267,11 +499,14 @@ class ED_Model:
             # Record the time the patient started queuing for ED assessment
             start_q_ed_assess = self.env.now
             
-            # Request an ED doctor
-            with self.ed_doctor.request() as req:
-                # Freeze the function until the request can be met
-                yield req
-                
+            # Request an ED doctor, and freeze the function until the
+            # request can be met (unless the patient leaves instead)
+            req = yield from self.join_queue(self.ed_doctor,
+                                             "ED_Assessment")
+            if req is None:
+                return
+            
+            with req:
                 # Record the time the patient finished queuing for ED 
                 # assessment
                 end_q_ed_assess = self.env.now
@@ -283,7 +518,8 @@ class ED_Model:
                 # Randomly sample the time the patient will spend being 
                 # assessed
                 sampled_ed_assess_duration = (
-                    random.expovariate(1.0 / g.mean_ed_assess))
+                    self.rng.stream("ed_assessment").expovariate(
+                        1.0 / self.scenario.mean_ed_assess))
                 
                 # Freeze this function until that time has elapsed
                 yield self.env.timeout(sampled_ed_assess_duration)
@@ -291,91 +527,134 @@ class ED_Model:
         # If the warm up time has passed, then call the store_patient_results 
         # method (this doesn't need to be processed by the environment, as it's
         # not a generator function, just a conventional function)
-        if self.env.now > g.warm_up_duration:
+        if self.env.now > self.warm_up_duration:
             self.store_patient_results(patient)
         
     # A method to store the patient's results (queuing times here) for this
-    # run alongside their patient ID in the Pandas DataFrame of the ED_Model
-    # class
-    def store_patient_results(self, patient):        
-        # First, because we have a branching path, this patient will have
-        # queued for either ED assessment or ACU assessment, but not both.
-        # Therefore, we need to check which happened, and insert NaNs
-        # (Not A Number) in the entries for the other queue in the DataFrame.
-        # NaNs are automatically ignored by Pandas when calculating the mean
-        # etc.  We can create a nan by casting the string 'nan' as a float :
-        # float("nan")
+    # run alongside their patient ID, and the time their journey ended, in the
+    # results recorder of the ED_Model class
+    def store_patient_results(self, patient):
+        # Because we have a branching path, this patient will have queued for
+        # either ED assessment or ACU assessment, but not both.  Therefore, we
+        # only record the queue that they went through - the recorder leaves
+        # the other one as a NaN (Not A Number).  NaNs are ignored when
+        # calculating the mean etc.
         if patient.acu_patient == True:
-            patient.q_time_ed_assess = float("nan")
+            self.results.record(patient.id,
+                                Q_Time_Registration=patient.q_time_reg,
+                                Q_Time_Triage=patient.q_time_triage,
+                                Q_Time_ACU_Assessment=(
+                                    patient.q_time_acu_assess),
+                                End_Time=self.env.now)
+            self.q_time_sketches["Q_Time_ACU_Assessment"].update(
+                patient.q_time_acu_assess)
         else:
-            patient.q_time_acu_assess = float("nan")
+            self.results.record(patient.id,
+                                Q_Time_Registration=patient.q_time_reg,
+                                Q_Time_Triage=patient.q_time_triage,
+                                Q_Time_ED_Assessment=(
+                                    patient.q_time_ed_assess),
+                                End_Time=self.env.now)
+            self.q_time_sketches["Q_Time_ED_Assessment"].update(
+                patient.q_time_ed_assess)
             
-        df_to_add = pd.DataFrame({"P_ID":[patient.id],
-                                  "Q_Time_Registration":[patient.q_time_reg],
-                                  "Q_Time_Triage":[patient.q_time_triage],
-                                  "Q_Time_ED_Assessment":(
-                                      [patient.q_time_ed_assess]),
-                                  "Q_Time_ACU_Assessment":(
-                                      [patient.q_time_acu_assess]),
-                                  })
-        
-        df_to_add.set_index("P_ID", inplace=True)
-        #self.results_df = self.results_df.append(df_to_add)
-        self.results_df = pd.concat([self.results_df, df_to_add])
+        self.q_time_sketches["Q_Time_Registration"].update(patient.q_time_reg)
+        self.q_time_sketches["Q_Time_Triage"].update(patient.q_time_triage)
 
     # A method that calculates the average queuing times for each queue.  We
     # can call this at the end of each run
     def calculate_mean_q_times(self):
         self.mean_q_time_registration = (
-            self.results_df["Q_Time_Registration"].mean())
+            self.results.mean("Q_Time_Registration"))
         self.mean_q_time_triage = (
-            self.results_df["Q_Time_Triage"].mean())
+            self.results.mean("Q_Time_Triage"))
         self.mean_q_time_ed_assessment = (
-            self.results_df["Q_Time_ED_Assessment"].mean())
+            self.results.mean("Q_Time_ED_Assessment"))
         self.mean_q_time_acu_assessment = (
-            self.results_df["Q_Time_ACU_Assessment"].mean())
-        
-    # A method to write run results to file
-    def write_run_results(self):
-        with open("trial_ed_results.csv", "a") as f:
-            writer = csv.writer(f, delimiter=",")
-            results_to_write = [self.run_number,
-                                self.mean_q_time_registration,
-                                self.mean_q_time_triage,
-                                self.mean_q_time_ed_assessment,
-                                self.mean_q_time_acu_assessment]
-            writer.writerow(results_to_write)
+            self.results.mean("Q_Time_ACU_Assessment"))
+        
+    # A method that returns the results of this run as a dictionary, with the
+    # run number alongside the mean queuing times, and the saved state of the
+    # quantile sketches.  This is what gets sent back to the parent process
+    # when the run is carried out by a worker
+    def get_run_summary(self):
+        run_summary = {
+            "Run":self.run_number,
+            "Mean_Q_Time_Registration":self.mean_q_time_registration,
+            "Mean_Q_Time_Triage":self.mean_q_time_triage,
+            "Mean_Q_Time_ED_Assessment":self.mean_q_time_ed_assessment,
+            "Mean_Q_Time_ACU_Assessment":self.mean_q_time_acu_assessment,
+            "Q_Time_Sketches":{name:sketch.to_dict() for name, sketch
+                               in self.q_time_sketches.items()}}
+        
+        # If patients can leave queues, add how many balked and reneged at
+        # each stage, and how long those who reneged waited on average
+        if self.scenario.mean_patience or self.scenario.balk_threshold:
+            for stage, counts in self.abandonments.items():
+                run_summary[f"Balked_{stage}"] = counts["Balked"]
+                run_summary[f"Reneged_{stage}"] = counts["Reneged"]
+                run_summary[f"Mean_Wait_Before_Reneging_{stage}"] = (
+                    counts["Wait_Before_Reneging"] / counts["Reneged"]
+                    if counts["Reneged"] > 0 else float("nan"))
+        
+        return run_summary
             
-    # The run method starts up the entity generators, and tells SimPy to start
-    # running the environment for the duration specified in the g class. After
-    # the simulation has run, it calls the methods that calculate run
-    # results, and the method that writes these results to file
+    # The run method runs the warm up period and then the results collection
+    # period.  These are separate methods so that the warm up can be run
+    # once, and several runs of the results collection period branched off
+    # from the end of it (see run_forked_replications in
+    # replication_runner.py)
     def run(self):
+        self.run_warm_up()
+        self.run_collection()
+    
+    # The run_warm_up method starts up the entity generators, and tells SimPy
+    # to run the environment until the end of the warm up period
+    def run_warm_up(self):
         # Start entity generators
         self.env.process(self.generate_ed_arrivals())
         
         # Run simulation
-        self.env.run(until=(g.sim_duration + g.warm_up_duration))
+        if self.warm_up_duration > 0:
+            self.env.run(until=self.warm_up_duration)
+    
+    # A method to give the model new random number streams for the given run
+    # number, so that runs branched off from the same warm up go their own
+    # way.  Everything already sampled (e.g. the length of an assessment
+    # that's already under way) stays as it is
+    def reseed(self, run_number):
+        self.run_number = run_number
+        self.rng = RNG_Context(self.rng.master_seed, run_number)
+    
+    # The run_collection method tells SimPy to carry on running the
+    # environment for the duration specified in the g class.  After the
+    # simulation has run, it calls the methods that store and calculate run
+    # results
+    def run_collection(self):
+        # Run simulation
+        self.env.run(until=(self.scenario.sim_duration +
+                            self.warm_up_duration))
         
-        # Calculate run results
+        # Store the patient level results in a DataFrame, and calculate run
+        # results
+        self.results_df = self.results.to_dataframe()
         self.calculate_mean_q_times()
-        
-        # Write run results to file
-        self.write_run_results()
 
 # Class to store, calculate and manipulate trial results
 class Trial_Results_Calculator:
-    def __init__(self):
-        self.trial_results_df = pd.DataFrame()
+    # The constructor is given the results from each run (which the trial
+    # results sink has kept in memory, so we don't need to read them back in
+    # from file), and the quantile sketches for each queue merged over all of
+    # the runs
+    def __init__(self, trial_results_df, trial_q_time_sketches=None):
+        self.trial_results_df = trial_results_df
+        self.trial_q_time_sketches = trial_q_time_sketches
         
-    # A method to read in the trial results and print them for the user
+    # A method to print the trial results for the user
     def print_trial_results(self):
         print ("TRIAL RESULTS")
         print ("-------------")
         
-        # Read in results from each run
-        self.trial_results_df = pd.read_csv("trial_ed_results.csv")
-        
         # Take average over runs
         trial_mean_q_time_registration = (
             self.trial_results_df["Mean_Q_Time_Registration"].mean())
@@ -394,36 +673,174 @@ class Trial_Results_Calculator:
                f"{trial_mean_q_time_ed_assess:.2f}")
         print ("Mean Queuing Time for ACU Assessment over Trial :",
                f"{trial_mean_q_time_acu_assess:.2f}")
+        
+        # Print the 95th and 99th percentile queuing times for each queue
+        # over the trial, if we've got the sketches to work them out from
+        if self.trial_q_time_sketches:
+            for column, queue_name in [
+                ("Q_Time_Registration", "Registration"),
+                ("Q_Time_Triage", "Triage"),
+                ("Q_Time_ED_Assessment", "ED Assessment"),
+                ("Q_Time_ACU_Assessment", "ACU Assessment")]:
+                sketch = self.trial_q_time_sketches[column]
+                
+                print (f"95th / 99th Percentile Queuing Time for {queue_name}",
+                       "over Trial :",
+                       f"{sketch.quantile(0.95):.2f} /",
+                       f"{sketch.quantile(0.99):.2f}")
+        
+        # Print how many patients left each queue without being seen, if
+        # they could
+        for stage in ["Registration", "Triage", "ED_Assessment",
+                      "ACU_Assessment"]:
+            if f"Reneged_{stage}" in self.trial_results_df:
+                stage_results_df = self.trial_results_df[
+                    [f"Balked_{stage}",
+                     f"Reneged_{stage}",
+                     f"Mean_Wait_Before_Reneging_{stage}"]].mean()
+                
+                print (f"Mean Patients Balking / Reneging at {stage} per",
+                       "Run :",
+                       f"{stage_results_df.iloc[0]:.2f} /",
+                       f"{stage_results_df.iloc[1]:.2f}",
+                       "(Mean Wait Before Reneging :",
+                       f"{stage_results_df.iloc[2]:.2f})")
 
 # Everything above is definition of classes and functions, but here's where
-# the code will start actively doing things.        
-
-# Create a file to store trial results
-with open("trial_ed_results.csv", "w") as f:
-    writer = csv.writer(f, delimiter=",")
-    column_headers = ["Run",
-                      "Mean_Q_Time_Registration",
-                      "Mean_Q_Time_Triage",
-                      "Mean_Q_Time_ED_Assessment",
-                      "Mean_Q_Time_ACU_Assessment"]
-    writer.writerow(column_headers)
-
-# For the number of runs specified in the g class, create an instance of the
-# ED_Model class, and call its run method
-for run in range(g.number_of_runs):
-    print (f"Run {run+1} of {g.number_of_runs}")
-    my_ed_model = ED_Model(run)
-    my_ed_model.run()
-    print ()
-
-# Once the trial is complete, we'll create an instance of the
-# Trial_Result_Calculator class and run the print_trial_results method
-my_trial_results_calculator = Trial_Results_Calculator()
-my_trial_results_calculator.print_trial_results()
-
-
+# the code will start actively doing things.  This needs to sit inside the
+# if block below so that the worker processes, which import this file to find
+# the ED_Model class, don't start trials of their own
+if __name__ == "__main__" and g.sweep_parameters:
+    # Run every scenario in the sweep, and print the mean of each mean
+    # queuing time over the runs of each scenario
+    if g.result_cache_directory:
+        result_cache = Result_Cache(g.result_cache_directory)
+    else:
+        result_cache = None
+    
+    # We ask for a column for every parameter in the sweep, even if it's
+    # only given one value, so we can group the results by them
+    sweep_results_df = run_sweep(
+        ED_Model,
+        scenario_grid(Scenario.from_class(g), **g.sweep_parameters),
+        g.number_of_runs, g.master_seed, g.number_of_workers,
+        result_cache=result_cache,
+        parameter_names=list(g.sweep_parameters))
+    sweep_results_df.to_csv(g.sweep_results_file, index=False)
+    
+    print (sweep_results_df.groupby(["Scenario", *g.sweep_parameters])
+           [["Mean_Q_Time_Registration",
+             "Mean_Q_Time_Triage",
+             "Mean_Q_Time_ED_Assessment",
+             "Mean_Q_Time_ACU_Assessment"]].mean())
+elif __name__ == "__main__":
+    # Every run of the model is given the parameters in the g class, fixed in
+    # a scenario (see scenario.py).  If we're working out the warm up
+    # automatically, do it before anything else, and pass it to each run too
+    scenario = Scenario.from_class(g)
+    model_kwargs = {"scenario":scenario}
+    
+    # Branching runs off a single warm up always does number_of_runs runs, so
+    # we can't also keep going until we reach a target precision
+    if g.fork_after_warm_up and g.target_precision is not None:
+        raise ValueError("fork_after_warm_up can't be used with " +
+                         "target_precision - set only one of them")
+    
+    if g.result_cache_directory:
+        result_cache = Result_Cache(g.result_cache_directory)
+    else:
+        result_cache = None
+    
+    if g.auto_warm_up:
+        model_kwargs["warm_up_duration"] = Warm_Up_Analyser().recommend(
+            ED_Model, scenario,
+            ["Q_Time_Registration",
+             "Q_Time_Triage",
+             "Q_Time_ED_Assessment",
+             "Q_Time_ACU_Assessment"],
+            g.number_of_pilot_runs, g.master_seed, g.number_of_workers)
+        
+        print (f"Warm up duration : {model_kwargs['warm_up_duration']}")
 
+    # Set up a sink to write the results of each run to, which will write
+    # them to file in batches in the background
+    trial_results_columns = ["Run",
+                             "Mean_Q_Time_Registration",
+                             "Mean_Q_Time_Triage",
+                             "Mean_Q_Time_ED_Assessment",
+                             "Mean_Q_Time_ACU_Assessment"]
+    
+    if g.mean_patience or g.balk_threshold:
+        for stage in ["Registration", "Triage", "ED_Assessment",
+                      "ACU_Assessment"]:
+            trial_results_columns += [f"Balked_{stage}",
+                                      f"Reneged_{stage}",
+                                      f"Mean_Wait_Before_Reneging_{stage}"]
+    
+    trial_results_sink = Trial_Results_Sink(g.trial_results_file,
+                                            trial_results_columns)
 
+    # Run the model across a pool of worker processes (each one creates an
+    # instance of the ED_Model class and calls its run method) - either the
+    # number of runs specified in the g class (optionally branching every
+    # run off from a single warm up), or, if we've set a target precision,
+    # until that precision is reached.  Or, if we're using the lockstep
+    # engine, work out the results of every run at once
+    if (g.engine == "lockstep" and not g.mean_patience and
+            not g.balk_threshold and g.number_of_cross_cover_doctors == 0):
+        if result_cache is not None:
+            print ("Warning : the result cache isn't used by the lockstep " +
+                   "engine")
+        
+        run_summaries = summarise_ed_network_runs(
+            simulate_ed_network(scenario, g.number_of_runs, g.master_seed,
+                                model_kwargs.get("warm_up_duration")),
+            g.number_of_runs).to_dict("records")
+    elif g.fork_after_warm_up:
+        if result_cache is not None:
+            print ("Warning : the result cache isn't used for runs " +
+                   "branched off a single warm up")
+        
+        # Each run is a fork of this process, which isn't safe once the
+        # sink's writer thread has started, so we let every run finish
+        # before passing any of them to the sink
+        run_summaries = list(run_forked_replications(ED_Model,
+                                                     g.number_of_runs,
+                                                     g.master_seed,
+                                                     g.number_of_workers,
+                                                     model_kwargs))
+    elif g.target_precision is None:
+        run_summaries = run_replications(ED_Model, g.number_of_runs,
+                                         g.master_seed, g.number_of_workers,
+                                         model_kwargs, result_cache)
+    else:
+        run_summaries = run_until_precision(
+            ED_Model,
+            ["Mean_Q_Time_Registration",
+             "Mean_Q_Time_Triage",
+             "Mean_Q_Time_ED_Assessment",
+             "Mean_Q_Time_ACU_Assessment"],
+            g.target_precision, g.confidence, g.min_runs, g.max_runs,
+            g.master_seed, g.number_of_workers, model_kwargs, result_cache)
 
+    # Pass each run's results to the sink as they come back, and merge each
+    # run's quantile sketches in to the sketches for the whole trial
+    trial_q_time_sketches = {}
+    
+    with trial_results_sink:
+        for run_summary in run_summaries:
+            print (f"Run {run_summary['Run']+1} complete")
+            trial_results_sink.write(run_summary)
+            
+            if "Q_Time_Sketches" in run_summary:
+                merge_sketch_states(trial_q_time_sketches,
+                                    run_summary["Q_Time_Sketches"])
 
+    print ()
 
+    # Once the trial is complete, we'll create an instance of the
+    # Trial_Result_Calculator class, giving it the results of each run, and
+    # run the print_trial_results method
+    my_trial_results_calculator = Trial_Results_Calculator(
+        trial_results_sink.to_dataframe(), trial_q_time_sketches)
+    my_trial_results_calculator.print_trial_results()
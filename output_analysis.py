@@ -0,0 +1,253 @@
+# OUTPUT ANALYSIS
+# Functions for working out how confident we can be in the results of a
+# trial.  The mean of a set of runs is only an estimate of the true mean, and
+# a confidence interval tells us how far from the true mean that estimate
+# could reasonably be.  For a set of n independent run results, the 95%
+# confidence interval for the mean is :
+#
+#     mean +/- t * (standard deviation / square root of n)
+#
+# where t comes from Student's t distribution with n - 1 degrees of freedom.
+# The "+/-" part is called the half width of the interval.  Dividing the half
+# width by the mean gives us the relative precision - e.g. a relative
+# precision of 0.05 means we're confident the true mean is within 5% of our
+# estimate.
+
+import math
+from statistics import NormalDist, mean, stdev
+import numpy as np
+
+# Function to work out the probability that a value from Student's t
+# distribution with a whole number of degrees of freedom is between -t and t.
+# There's an exact formula for this (Abramowitz and Stegun 26.7.3 and 26.7.4)
+# - a sum of powers of cos(theta), where theta = atan(t / sqrt(v)), with one
+# term for every 2 degrees of freedom
+def t_two_sided_probability(t, degrees_of_freedom):
+    v = degrees_of_freedom
+    theta = math.atan(t / math.sqrt(v))
+    cos_squared = math.cos(theta) ** 2
+
+    if v % 2 == 1:
+        term = math.cos(theta)
+        total = term if v > 1 else 0.0
+        first_power = 1
+    else:
+        term = 1.0
+        total = term
+        first_power = 0
+
+    for power in range(first_power, v - 3, 2):
+        term *= cos_squared * (power + 1) / (power + 2)
+        total += term
+
+    if v % 2 == 1:
+        return 2 / math.pi * (theta + math.sin(theta) * total)
+
+    return math.sin(theta) * total
+
+# Function to find the value of t for a given confidence level (e.g. 0.95)
+# and number of degrees of freedom.  For 1 and 2 degrees of freedom there's an
+# exact formula.  Otherwise, we start from the equivalent value for the
+# Normal distribution, corrected using the Cornish-Fisher expansion.  That's
+# close, but with only a few degrees of freedom it's too small by up to 0.05
+# (e.g. 5.795 instead of 5.841 for 3 degrees of freedom at 99%), so we then
+# use Newton's method with the exact probability above to make it exact
+def t_critical_value(confidence, degrees_of_freedom):
+    p = 0.5 + confidence / 2
+    v = degrees_of_freedom
+
+    if v == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if v == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+
+    z = NormalDist().inv_cdf(p)
+
+    t = (z
+         + (z**3 + z) / (4 * v)
+         + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * v**2)
+         + (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / (384 * v**3)
+         + (79 * z**9 + 776 * z**7 + 1482 * z**5 - 1920 * z**3 - 945 * z)
+         / (92160 * v**4))
+
+    # The slope of the two sided probability is twice the density of the t
+    # distribution
+    log_density_constant = (math.lgamma((v + 1) / 2) - math.lgamma(v / 2)
+                            - 0.5 * math.log(v * math.pi))
+
+    for _ in range(20):
+        density = math.exp(log_density_constant
+                           - (v + 1) / 2 * math.log1p(t * t / v))
+        step = (t_two_sided_probability(t, v) - confidence) / (2 * density)
+        t -= step
+
+        if abs(step) < 1e-12 * t:
+            break
+
+    return t
+
+# Function to calculate the mean and the half width of the confidence
+# interval for the mean of a list of values.  NaNs (e.g. from a run where
+# nobody went to the ACU) are ignored.  If there are fewer than 2 values, the
+# half width can't be calculated, so we return infinity
+def confidence_interval(values, confidence=0.95):
+    values = [value for value in values if not math.isnan(value)]
+
+    if len(values) < 2:
+        return float("nan"), float("inf")
+
+    half_width = (t_critical_value(confidence, len(values) - 1)
+                  * stdev(values) / math.sqrt(len(values)))
+
+    return mean(values), half_width
+
+# Function to calculate the relative precision (half width / mean) of the
+# confidence interval for a list of values.  If the half width is 0 (e.g.
+# nobody ever queued), then the precision is perfect, whatever the mean
+def relative_precision(values, confidence=0.95):
+    values_mean, half_width = confidence_interval(values, confidence)
+
+    if half_width == 0:
+        return 0.0
+    if math.isinf(half_width) or values_mean == 0:
+        return float("inf")
+
+    return half_width / abs(values_mean)
+
+# Function to find the truncation point for a series of results using the
+# MSER-5 rule (Marginal Standard Error Rule, with batches of 5).  The series
+# is split in to batches of 5 values, and we take the mean of each batch.
+# Then, for each number of batches d we could delete from the start, we work
+# out how uncertain the mean of the remaining batches would be :
+#
+#     MSER(d) = sum of squared differences from the mean of batches after d
+#               / (number of batches after d) squared
+#
+# Deleting the early, unrepresentative batches brings this down, but
+# deleting too many pushes it back up (as we've got less data left).  The
+# truncation point is the d with the lowest MSER.  We only look in the first
+# half of the series, as MSER isn't reliable when there's little data left.
+# Returns the number of values to delete from the start of the series
+def mser5_truncation_point(series):
+    series = np.asarray(series, dtype=float)
+    number_of_batches = len(series) // 5
+
+    if number_of_batches < 2:
+        return 0
+
+    batch_means = series[:number_of_batches * 5].reshape(-1, 5).mean(axis=1)
+
+    # The sums of the batch means (and their squares) after each d, worked
+    # out for every d at once
+    remaining = np.arange(number_of_batches, 0, -1)
+    sums = np.cumsum(batch_means[::-1])[::-1]
+    sums_of_squares = np.cumsum(batch_means[::-1]**2)[::-1]
+
+    mser = (sums_of_squares - sums**2 / remaining) / remaining**2
+
+    d = int(np.argmin(mser[:number_of_batches // 2 + 1]))
+
+    return d * 5
+
+# Function to calculate the lag-1 autocorrelation of a series - how closely
+# each value is related to the one before it.  Close to 0 means the values
+# are (roughly) independent of each other
+def lag1_autocorrelation(series):
+    series = np.asarray(series, dtype=float)
+    differences = series - series.mean()
+    sum_of_squares = (differences**2).sum()
+
+    if len(series) < 2 or sum_of_squares == 0:
+        return 0.0
+
+    return (differences[:-1] * differences[1:]).sum() / sum_of_squares
+
+# Class to work out a confidence interval from a single long run, using the
+# method of batch means.  The results from one run aren't independent (a
+# patient who queues for a long time is usually followed by another who
+# does), so we can't treat them like the results of separate runs.  Instead,
+# we split them in to batches, one after another, and take the mean of each
+# batch.  If the batches are big enough, the batch means are close to
+# independent, and we can use them like the results of separate runs.
+#
+# We don't know in advance how big the batches need to be, so we start with
+# batches of 1 value, and every time we've got max_batches batches, we
+# combine them in pairs, doubling the batch size.  This means we only ever
+# keep max_batches batch means, however long the run is.  At the end, we keep
+# doubling the batch size until the lag-1 autocorrelation of the batch means
+# is below correlation_threshold (while keeping at least min_batches
+# batches), and use the batch means at that size to work out the half width
+# of the confidence interval.  The mean itself is the mean of every value,
+# including any that didn't make it in to a full batch
+class Batch_Means_Accumulator:
+    def __init__(self, max_batches=128, min_batches=10,
+                 correlation_threshold=0.2):
+        self.max_batches = max_batches
+        self.min_batches = min_batches
+        self.correlation_threshold = correlation_threshold
+
+        self.batch_size = 1
+        self.batch_means = []
+        self.current_batch_total = 0.0
+        self.current_batch_count = 0
+
+        # The total and number of every value so far
+        self.total = 0.0
+        self.count = 0
+
+    # Method to add a new value
+    def update(self, value):
+        self.total += value
+        self.count += 1
+
+        self.current_batch_total += value
+        self.current_batch_count += 1
+
+        if self.current_batch_count == self.batch_size:
+            self.batch_means.append(self.current_batch_total
+                                    / self.batch_size)
+            self.current_batch_total = 0.0
+            self.current_batch_count = 0
+
+            if len(self.batch_means) == self.max_batches:
+                self.batch_means = combine_batch_pairs(self.batch_means)
+                self.batch_size *= 2
+
+    # Method to choose the batch size, using the lag-1 autocorrelation of the
+    # batch means.  Returns the batch means at the chosen size, and the batch
+    # size.  If the batch means are still correlated at the biggest batch
+    # size we can use, we return that, but the confidence interval will be
+    # too narrow - the run needs to be longer
+    def choose_batches(self):
+        batch_means = self.batch_means
+        batch_size = self.batch_size
+
+        while (abs(lag1_autocorrelation(batch_means))
+               > self.correlation_threshold
+               and len(batch_means) // 2 >= self.min_batches):
+            batch_means = combine_batch_pairs(batch_means)
+            batch_size *= 2
+
+        return batch_means, batch_size
+
+    # Method to calculate the mean of every value, and the half width of the
+    # confidence interval from the batch means, along with the batch size and
+    # the number of batches used.  Values in a batch that hasn't been filled
+    # yet (or an odd batch left over when batches are combined) are left out
+    # of the half width, but not the mean
+    def confidence_interval(self, confidence=0.95):
+        batch_means, batch_size = self.choose_batches()
+        _, half_width = confidence_interval(batch_means, confidence)
+
+        if self.count == 0:
+            values_mean = float("nan")
+        else:
+            values_mean = self.total / self.count
+
+        return values_mean, half_width, batch_size, len(batch_means)
+
+# Function to combine a list of batch means in pairs, giving the means of
+# batches twice the size (an odd batch at the end is dropped)
+def combine_batch_pairs(batch_means):
+    return [(batch_means[i] + batch_means[i + 1]) / 2
+            for i in range(0, len(batch_means) - 1, 2)]
@@ -0,0 +1,102 @@
+# RENEGING - PATIENTS WHO GIVE UP WAITING
+# The usual way to let a patient give up waiting after their patience runs
+# out is to wait for whichever comes first out of their request being met
+# and a timeout :
+#
+#     result = yield req | self.env.timeout(patience)
+#
+# The trouble is that SimPy can't cancel a timeout.  Every patient who's seen
+# before their patience runs out leaves their timeout behind in SimPy's list
+# of scheduled events, until it goes off, long after it stopped mattering.
+# With long patience times and lots of patients, most of that list can end up
+# being timeouts that don't matter any more, and every event gets slower to
+# schedule.
+#
+# Patience_Monitor keeps the patience deadlines in a heap of its own instead,
+# shared by every patient, and only ever has an alarm set in SimPy for the
+# earliest one still waiting.  When the alarm goes off, anyone whose deadline
+# has passed and who is still waiting is told they've run out of patience.
+# The deadlines of patients who have already been seen are just thrown away
+# when they come up (we never need to go and find them), and we don't set
+# alarms for them.
+#
+# It works with anything a patient waits for that's an event - a request for
+# a Resource or PriorityResource, or a get from a Container or Store.  If
+# they run out of patience, it's up to the patient to cancel what they were
+# waiting for :
+#
+#     req = self.ed_doctor.request()
+#     yield self.patience_monitor.wait(req, patience)
+#
+#     if not req.triggered:
+#         # Out of patience - leave the queue
+#         req.cancel()
+
+import heapq
+import itertools
+import math
+
+# Class representing the patience deadlines of everyone waiting in a model
+class Patience_Monitor:
+    def __init__(self, env):
+        self.env = env
+
+        # A heap of (deadline, order, event being waited for, event that
+        # triggers if the patience runs out)
+        self.deadlines = []
+        self.counter = itertools.count()
+
+        # The deadline the current alarm is set for, and the alarm itself.
+        # Alarms that have been replaced by an earlier one are still in
+        # SimPy's schedule, but are ignored when they go off
+        self.wake_time = math.inf
+        self.alarm = None
+
+    # Method to wait for an event for up to patience minutes.  Returns an
+    # event to yield, which triggers when the event does, or when the patience
+    # runs out, whichever is first
+    def wait(self, event, patience):
+        out_of_patience = self.env.event()
+        deadline = self.env.now + patience
+
+        heapq.heappush(self.deadlines, (deadline, next(self.counter), event,
+                                        out_of_patience))
+
+        if deadline < self.wake_time:
+            self.set_alarm(deadline)
+
+        return event | out_of_patience
+
+    # Method to set an alarm for the given deadline, replacing the current
+    # one
+    def set_alarm(self, time):
+        self.wake_time = time
+        self.alarm = self.env.timeout(max(0, time - self.env.now))
+        self.alarm.callbacks.append(self.wake)
+
+    # Method called when an alarm goes off
+    def wake(self, alarm):
+        # An alarm that was replaced by an earlier one doesn't matter any more.
+        # We check which alarm it is, rather than the time, as adding the
+        # time until the deadline to the current time doesn't always give
+        # exactly the deadline
+        if alarm is not self.alarm:
+            return
+
+        self.alarm = None
+
+        while self.deadlines and self.deadlines[0][0] <= self.wake_time:
+            _, _, event, out_of_patience = heapq.heappop(self.deadlines)
+
+            if not event.triggered:
+                out_of_patience.succeed()
+
+        # Throw away the deadlines of anyone who's already been seen, so we
+        # only set an alarm for someone who's still waiting
+        while self.deadlines and self.deadlines[0][2].triggered:
+            heapq.heappop(self.deadlines)
+
+        self.wake_time = math.inf
+
+        if self.deadlines:
+            self.set_alarm(self.deadlines[0][0])
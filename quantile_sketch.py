@@ -0,0 +1,160 @@
+# QUANTILE SKETCHES
+# The mean queuing time doesn't tell us much about the patients who wait the
+# longest, and targets are often set on percentiles instead - e.g. 95% of
+# patients should be seen within 4 hours.  To work out a percentile exactly,
+# we'd need to keep every patient's queuing time from every run.
+#
+# A quantile sketch gets us very close to the right answer while only keeping
+# a few hundred values, however many patients there are.  This one is a KLL
+# sketch (after Karnin, Lang and Liberty).  Values go in to a buffer at level
+# 0.  When a buffer fills up, it's sorted and every other value is promoted
+# to the level above (and the rest are thrown away).  Each value at level h
+# therefore stands in for 2^h of the original values.  Lower levels get
+# smaller buffers, so the sketch stays small, while the values that have been
+# through the most compactions (and so are the least accurate) are kept in
+# the biggest buffers.
+#
+# Sketches from different runs (or different worker processes) can be
+# merged, and the result is as accurate as if every value had gone in to a
+# single sketch.  They can also be saved as a dictionary, to be sent back
+# from worker processes.
+
+import math
+
+# Class representing a KLL quantile sketch.  k controls the accuracy - the
+# error in the rank of any value is around 1.7 / k (so around 1% for the
+# default of 200)
+class Quantile_Sketch:
+    def __init__(self, k=200):
+        self.k = k
+        self.compactors = []
+        # Which of each pair of values to promote next time each level is
+        # compacted - we alternate, rather than choosing at random, so that
+        # results can be repeated
+        self.offsets = []
+        self.size = 0
+        self.max_size = 0
+        self.grow()
+
+    # Method to add a new level on top of the existing ones
+    def grow(self):
+        self.compactors.append([])
+        self.offsets.append(0)
+        self.max_size = sum(self.capacity(h)
+                            for h in range(len(self.compactors)))
+
+    # The number of values the buffer at level h can hold before it's
+    # compacted.  The top level holds k values, and each level down holds
+    # 2/3 as many as the one above
+    def capacity(self, h):
+        height = len(self.compactors) - h - 1
+
+        return int(math.ceil((2 / 3)**height * self.k)) + 1
+
+    # Method to add a new value
+    def update(self, value):
+        self.compactors[0].append(value)
+        self.size += 1
+
+        if self.size >= self.max_size:
+            self.compress()
+
+    # Method to compact the lowest level that's full, promoting every other
+    # value in it to the level above
+    def compress(self):
+        for h in range(len(self.compactors)):
+            if len(self.compactors[h]) >= self.capacity(h):
+                if h + 1 == len(self.compactors):
+                    self.grow()
+
+                compactor = self.compactors[h]
+                compactor.sort()
+
+                # If there's an odd number of values, the last one stays
+                # where it is
+                kept = [compactor.pop()] if len(compactor) % 2 else []
+
+                self.compactors[h + 1].extend(compactor[self.offsets[h]::2])
+                self.offsets[h] = 1 - self.offsets[h]
+                self.compactors[h] = kept
+
+                self.size = sum(len(compactor)
+                                for compactor in self.compactors)
+                break
+
+    # Method to merge another sketch in to this one
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self.grow()
+
+        for h, compactor in enumerate(other.compactors):
+            self.compactors[h].extend(compactor)
+
+        self.size = sum(len(compactor) for compactor in self.compactors)
+
+        while self.size >= self.max_size:
+            self.compress()
+
+        return self
+
+    # The number of values the sketch represents
+    @property
+    def count(self):
+        return sum(len(compactor) * 2**h
+                   for h, compactor in enumerate(self.compactors))
+
+    # Method to estimate the value at the given quantile (e.g. 0.95 for the
+    # 95th percentile)
+    def quantile(self, q):
+        weighted_values = sorted((value, 2**h)
+                                 for h, compactor in enumerate(self.compactors)
+                                 for value in compactor)
+
+        if not weighted_values:
+            return float("nan")
+
+        target_weight = q * self.count
+        cumulative_weight = 0
+
+        for value, weight in weighted_values:
+            cumulative_weight += weight
+
+            if cumulative_weight >= target_weight:
+                return value
+
+        return weighted_values[-1][0]
+
+    # Methods to save the state of the sketch as a dictionary, and to create a
+    # sketch from a saved state
+    def to_dict(self):
+        return {"k":self.k,
+                "compactors":[list(compactor)
+                              for compactor in self.compactors],
+                "offsets":list(self.offsets)}
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state["k"])
+
+        while len(sketch.compactors) < len(state["compactors"]):
+            sketch.grow()
+
+        sketch.compactors = [list(compactor)
+                             for compactor in state["compactors"]]
+        sketch.offsets = list(state["offsets"])
+        sketch.size = sum(len(compactor) for compactor in sketch.compactors)
+
+        return sketch
+
+# Function to merge a dictionary of saved sketch states (e.g. one per queue,
+# sent back from a run) in to a dictionary of sketches
+def merge_sketch_states(sketches, sketch_states):
+    for name, sketch_state in sketch_states.items():
+        sketch = Quantile_Sketch.from_dict(sketch_state)
+
+        if name in sketches:
+            sketches[name].merge(sketch)
+        else:
+            sketches[name] = sketch
+
+    return sketches
@@ -56,7 +56,7 @@
 
 import simpy
 import random
-from statistics import mean
+from online_statistics import Welford_Accumulator
 import csv
 import pandas as pd
 
@@ -105,12 +105,12 @@ def activity_generator_call(env, mean_call, receptionist):
 # Activity generator for receptionist registering patients
 def activity_generator_gp(env, mean_register, mean_consult, mean_book_test,
                           receptionist, gps):
-    # Define the global lists we will be using to capture mean times and system
-    # times
-    global list_of_times_spent_in_registration_queue
-    global list_of_times_spent_in_gp_consultation_queue
-    global list_of_times_spent_in_booking_test_queue
-    global list_of_times_spent_in_the_entire_system
+    # Define the global accumulators we will be using to capture queuing
+    # times and system times
+    global registration_queue_time_stats
+    global gp_consultation_queue_time_stats
+    global booking_test_queue_time_stats
+    global system_time_stats
     global warm_up_period
 
     # Record entrance of person within the system
@@ -133,9 +133,9 @@ def activity_generator_gp(env, mean_register, mean_consult, mean_book_test,
             time_entered_queue_for_registration
         )
 
-        # Append the time spent by person in queue to our global list
+        # Add the time spent by person in queue to our global accumulator
         if env.now > warm_up_period:
-            list_of_times_spent_in_registration_queue.append(
+            registration_queue_time_stats.update(
                 time_spent_in_registration_queue
             )
 
@@ -162,9 +162,10 @@ def activity_generator_gp(env, mean_register, mean_consult, mean_book_test,
             time_entered_queue_for_gp_consultation
         )
 
-        # append time spent by person in consultation queue to our global list
+        # add time spent by person in consultation queue to our global
+        # accumulator
         if env.now > warm_up_period:
-            list_of_times_spent_in_gp_consultation_queue.append(
+            gp_consultation_queue_time_stats.update(
                 time_spent_in_gp_consultation_queue
             )
 
@@ -206,10 +207,10 @@ def activity_generator_gp(env, mean_register, mean_consult, mean_book_test,
                 time_entered_queue_for_booking_test
             )
 
-            # append the time spent by person in booking test queue to our global
-            # list
+            # add the time spent by person in booking test queue to our global
+            # accumulator
             if env.now > warm_up_period:
-                list_of_times_spent_in_booking_test_queue.append(
+                booking_test_queue_time_stats.update(
                     time_spent_in_booking_test_queue
                 )
 
@@ -230,9 +231,9 @@ def activity_generator_gp(env, mean_register, mean_consult, mean_book_test,
         time_entered_system
     )
 
-    # Append this system time to our global list_of_times_spent_in_entire_system list
+    # Add this system time to our global system_time_stats accumulator
     if env.now > warm_up_period:
-        list_of_times_spent_in_the_entire_system.append(time_spent_in_system)
+        system_time_stats.update(time_spent_in_system)
 
 # Both the arrival and activity generator are created at this point, 
 # let us go ahead and use them
@@ -243,12 +244,17 @@ number_of_simulation_runs = 100
 results_collection_period = 480 # how long the simulation will run after warm up
 warm_up_period = 180
 
+# The target for the time a person spends in the surgery - we count how many
+# people go over this
+target_system_time = 30
+
 # Create a file to store the results of each run, and write the column headers
 with open("gp_results.csv", "w") as f:
     writter = csv.writer(f, delimiter=",")
 
     writter.writerow(["Run", "Mean Q Registration", "Mean Q Consultation", 
-                      "Mean Q Booking Test", "Mean System Time"])
+                      "Mean Q Booking Test", "Mean System Time",
+                      "Prop Over Target System Time"])
 
 # Run the simulation the number of times specified, storing the results of each
 # run to file
@@ -261,12 +267,12 @@ for run in range(number_of_simulation_runs):
     receptionist = simpy.Resource(env, capacity=2) # base case = 1
     gps = simpy.Resource(env, capacity=3) # base case = 2
 
-    # Create lists to hold means for the different queues
-    # mean time in the system (point of arrival to point of departure)
-    list_of_times_spent_in_registration_queue = []
-    list_of_times_spent_in_gp_consultation_queue = []
-    list_of_times_spent_in_booking_test_queue = []
-    list_of_times_spent_in_the_entire_system = []
+    # Create accumulators to keep statistics for the different queues and
+    # the time in the system (point of arrival to point of departure)
+    registration_queue_time_stats = Welford_Accumulator()
+    gp_consultation_queue_time_stats = Welford_Accumulator()
+    booking_test_queue_time_stats = Welford_Accumulator()
+    system_time_stats = Welford_Accumulator(sla_threshold=target_system_time)
 
     # Enter parameters here
     gp_inter = 3
@@ -286,12 +292,14 @@ for run in range(number_of_simulation_runs):
     # Run the simulation for 8 hours
     env.run(until=(warm_up_period + results_collection_period )) 
 
-    # Print the different mean queuing times for registration, consultation,
-    # booking, and mean time spent in entire system
-    mean_queuing_time_for_registration = mean(list_of_times_spent_in_registration_queue)
-    mean_queuing_time_for_gp_consultation = mean(list_of_times_spent_in_gp_consultation_queue)
-    mean_queuing_time_for_booking_test = mean(list_of_times_spent_in_booking_test_queue)
-    mean_time_spent_in_entire_system = mean(list_of_times_spent_in_the_entire_system)
+    # Get the different mean queuing times for registration, consultation,
+    # booking, and mean time spent in entire system, along with the
+    # proportion of people who were in the system for longer than the target
+    mean_queuing_time_for_registration = registration_queue_time_stats.mean
+    mean_queuing_time_for_gp_consultation = gp_consultation_queue_time_stats.mean
+    mean_queuing_time_for_booking_test = booking_test_queue_time_stats.mean
+    mean_time_spent_in_entire_system = system_time_stats.mean
+    prop_over_target_system_time = system_time_stats.breach_rate
 
     # Set up list to write to file - here we'll store the run number alongside
     # all the other mean values in that run
@@ -299,7 +307,8 @@ for run in range(number_of_simulation_runs):
                      mean_queuing_time_for_registration,
                      mean_queuing_time_for_gp_consultation,
                      mean_queuing_time_for_booking_test,
-                     mean_time_spent_in_entire_system]
+                     mean_time_spent_in_entire_system,
+                     prop_over_target_system_time]
 
     # Store the run results to file. We need to open in append mode ('a').
     # otherwise we'll overwrite the file each time. That's why we set up the
@@ -320,6 +329,7 @@ mean_trial_queuing_time_for_registration = results_df["Mean Q Registration"].mea
 mean_trial_queuing_time_for_consultation = results_df["Mean Q Consultation"].mean()
 mean_trial_queuing_time_for_booking_test = results_df["Mean Q Booking Test"].mean()
 mean_trial_overall_system_time = results_df["Mean System Time"].mean()
+mean_trial_prop_over_target = results_df["Prop Over Target System Time"].mean()
 
 print("Trial Results")
 print("---------------------------------------------------")
@@ -327,3 +337,4 @@ print(f"Mean registration queuing time (mins) : {mean_trial_queuing_time_for_reg
 print(f"Mean consultation queuing time (mins) : {mean_trial_queuing_time_for_consultation:.2f}")
 print(f"Mean booking test queuing time (mins) : {mean_trial_queuing_time_for_booking_test:.2f}")
 print(f"Mean overall system time over (mins) : {mean_trial_overall_system_time:.2f}")
+print(f"Proportion over {target_system_time} mins in system : {mean_trial_prop_over_target:.2f}")
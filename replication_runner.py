@@ -0,0 +1,264 @@
+# PARALLEL REPLICATIONS
+# Each run of one of our models is independent of every other run - it has
+# its own SimPy environment, its own resources and its own patients.  That
+# means there's no reason to run them one after the other.  Here, we hand the
+# runs out to a pool of worker processes (one per CPU core by default).  Each
+# worker builds the model for the run number it's been given, runs it, and
+# sends back a small dictionary summarising the run (the run number alongside
+# the mean queuing times).  The parent process gets these summaries back in
+# run order, so it can write them to file exactly as the single process
+# version did.
+#
+# To make sure the results don't depend on how many workers we use (or on
+# which worker happens to pick up which run), each model seeds its random
+# number streams from the master seed and its own run number (see
+# rng_streams.py).  Run 7 therefore gives the same results whether it's run
+# on its own, in a single process, or on the 7th core of a 32 core machine.
+#
+# Any model class can be used here, as long as :
+# - its constructor takes the run number and the master seed (and any other
+#   keyword arguments we pass in model_kwargs)
+# - it has a run() method that runs the simulation and calculates results
+# - it has a get_run_summary() method that returns a dictionary of results
+#
+# If we pass in a result_cache (see result_cache.py), runs whose results are
+# already in the cache are looked up rather than simulated again.
+#
+# Note - because the worker processes need to be able to find the model
+# class, the code in the script that starts the trial needs to sit inside an
+# if __name__ == "__main__": block
+
+import os
+import pickle
+import signal
+import sys
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from output_analysis import relative_precision
+
+# Function that carries out a single run of the model.  This is what gets
+# sent to each worker process, so it needs to be a normal (module level)
+# function rather than a method, otherwise it can't be passed between
+# processes
+def run_single_replication(model_class, master_seed, model_kwargs,
+                           run_number, result_cache=None):
+    model = model_class(run_number, master_seed, **model_kwargs)
+
+    if result_cache is not None:
+        return result_cache.run(model)
+
+    model.run()
+
+    return model.get_run_summary()
+
+# Generator function that runs the given number of runs of the model across a
+# pool of worker processes, and hands back each run's summary, in run order,
+# as soon as it's available.  If we ask for a single worker, we just run
+# everything in this process (which is handy for debugging, and avoids the
+# cost of starting up the pool)
+def run_replications(model_class, number_of_runs, master_seed=42,
+                     number_of_workers=None, model_kwargs=None,
+                     result_cache=None):
+    if number_of_workers is None:
+        number_of_workers = os.cpu_count() or 1
+
+    run_numbers = range(number_of_runs)
+    run_one = partial(run_single_replication, model_class, master_seed,
+                      model_kwargs or {}, result_cache=result_cache)
+
+    if number_of_workers == 1:
+        for run_number in run_numbers:
+            yield run_one(run_number)
+        return
+
+    # Send the runs to the workers in chunks, so we're not paying the cost
+    # of passing messages between processes for every single run, but keep
+    # the chunks small enough that all of the workers stay busy until the end
+    chunksize = max(1, number_of_runs // (number_of_workers * 4))
+
+    with ProcessPoolExecutor(max_workers=number_of_workers) as pool:
+        yield from pool.map(run_one, run_numbers, chunksize=chunksize)
+
+# Function to check whether every one of the given metrics has reached the
+# target relative precision over the run summaries collected so far
+def precision_reached(run_summaries, metrics, target_precision, confidence):
+    for metric in metrics:
+        values = [run_summary[metric] for run_summary in run_summaries]
+
+        if relative_precision(values, confidence) > target_precision:
+            return False
+
+    return True
+
+# Generator function that keeps launching runs of the model until every one
+# of the given metrics has reached the target relative precision (e.g. 0.05
+# means the confidence interval half width is within 5% of the mean), and
+# then stops.  We always do at least min_runs runs (so we've got a
+# reasonable estimate of the variance before we trust the confidence
+# intervals), and never more than max_runs.
+#
+# The workers are kept busy by always having one run in progress per worker.
+# We check the stopping rule as each run comes back, in run order, so the
+# runs we end up with (and therefore the results) don't depend on the number
+# of workers - any runs still in progress when we stop are just thrown away
+def run_until_precision(model_class, metrics, target_precision=0.05,
+                        confidence=0.95, min_runs=10, max_runs=1000,
+                        master_seed=42, number_of_workers=None,
+                        model_kwargs=None, result_cache=None):
+    if number_of_workers is None:
+        number_of_workers = os.cpu_count() or 1
+
+    run_one = partial(run_single_replication, model_class, master_seed,
+                      model_kwargs or {}, result_cache=result_cache)
+    run_summaries = []
+
+    # Function to decide whether we can stop after the runs so far
+    def should_stop():
+        return (len(run_summaries) >= max_runs or
+                (len(run_summaries) >= min_runs and
+                 precision_reached(run_summaries, metrics, target_precision,
+                                   confidence)))
+
+    if number_of_workers == 1:
+        for run_number in range(max_runs):
+            run_summaries.append(run_one(run_number))
+            yield run_summaries[-1]
+
+            if should_stop():
+                return
+        return
+
+    with ProcessPoolExecutor(max_workers=number_of_workers) as pool:
+        runs_in_progress = deque()
+        next_run_number = 0
+
+        while True:
+            # Top up the runs in progress so there's one per worker
+            while (len(runs_in_progress) < number_of_workers and
+                   next_run_number < max_runs):
+                runs_in_progress.append(pool.submit(run_one, next_run_number))
+                next_run_number += 1
+
+            run_summaries.append(runs_in_progress.popleft().result())
+            yield run_summaries[-1]
+
+            if should_stop():
+                for run_in_progress in runs_in_progress:
+                    run_in_progress.cancel()
+                return
+
+# The run number used for the random number streams of the shared warm up in
+# run_forked_replications, kept well away from the run numbers of the runs
+# branched off from it
+SNAPSHOT_RUN_NUMBER = 2000000
+
+# Function to start a single run branched off from a model that's reached the
+# end of its warm up.  We use os.fork() to make a copy of this process, which
+# is an exact copy of the model as it stands - the patients in each queue,
+# the patients being seen, every pending timeout and the random number
+# streams.  The copy gives the model new random number streams for its run
+# number, runs the results collection period, and sends the run summary back
+# down a pipe.  The original model is left untouched, ready to be copied
+# again for the next run.  Returns the process ID of the copy and the end of
+# the pipe to read its results from
+def fork_replication(model, run_number):
+    # Anything waiting to be printed would otherwise be printed again by the
+    # copy
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        os.close(read_end)
+        exit_code = 0
+
+        try:
+            model.reseed(run_number)
+            model.run_collection()
+
+            with os.fdopen(write_end, "wb") as f:
+                f.write(pickle.dumps(model.get_run_summary()))
+        except BaseException:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exit_code)
+
+    os.close(write_end)
+
+    return pid, read_end, run_number
+
+# Function to wait for a run started by fork_replication to finish, and get
+# its run summary
+def collect_forked_replication(pid, read_end, run_number):
+    try:
+        with os.fdopen(read_end, "rb") as f:
+            data = f.read()
+    finally:
+        _, status = os.waitpid(pid, 0)
+
+    if status != 0 or not data:
+        raise RuntimeError(f"Run {run_number} failed")
+
+    return pickle.loads(data)
+
+# Generator function that runs the warm up period of the model once, and then
+# branches each of the runs off from the end of it, rather than having every
+# run simulate the warm up from empty.  Each run gets its own random number
+# streams from the end of the warm up onwards, so the runs are still
+# different from each other, but they all start from the same state - so the
+# results tell us about this particular starting state, rather than every
+# state the system could be in at the end of a warm up.  This is fine for a
+# long results collection period, but for short ones, use run_replications.
+#
+# The model class must have run_warm_up(), reseed() and run_collection()
+# methods as well as those needed by run_replications.  We keep at most
+# number_of_workers runs going at once, and hand back run summaries in run
+# order.  os.fork() isn't available on Windows, so there we fall back to
+# run_replications
+def run_forked_replications(model_class, number_of_runs, master_seed=42,
+                            number_of_workers=None, model_kwargs=None):
+    if not hasattr(os, "fork"):
+        yield from run_replications(model_class, number_of_runs, master_seed,
+                                    number_of_workers, model_kwargs)
+        return
+
+    if number_of_workers is None:
+        number_of_workers = os.cpu_count() or 1
+
+    model = model_class(SNAPSHOT_RUN_NUMBER, master_seed,
+                        **(model_kwargs or {}))
+    model.run_warm_up()
+
+    runs_in_progress = deque()
+    next_run_number = 0
+
+    # If we stop early (a run fails, or whatever is using the run summaries
+    # stops asking for them), stop any runs still going and wait for them,
+    # so they're not left behind as zombie processes
+    try:
+        while runs_in_progress or next_run_number < number_of_runs:
+            # Top up the runs in progress so there's one per worker
+            while (len(runs_in_progress) < number_of_workers and
+                   next_run_number < number_of_runs):
+                runs_in_progress.append(fork_replication(model,
+                                                         next_run_number))
+                next_run_number += 1
+
+            yield collect_forked_replication(*runs_in_progress.popleft())
+    finally:
+        for pid, read_end, _ in runs_in_progress:
+            os.close(read_end)
+
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+            os.waitpid(pid, 0)
@@ -0,0 +1,220 @@
+# RESOURCES WHOSE QUEUES CAN BE REPRIORITISED
+# With a PriorityResource, a patient's priority is fixed when they join the
+# queue.  In reality, patients waiting to be seen can get worse and need
+# seeing sooner, and patients with a low priority can end up waiting for ever
+# if there's always someone with a higher priority in front of them - so
+# people who have waited a long time are often moved up (this is called
+# aging).
+#
+# Reprioritisable_Resource keeps its queue in an indexed heap.  A heap is a
+# tree, stored in a list, where every request comes before the requests
+# below it, so the request at the top is always the next to be seen.  We
+# also keep a dictionary of where each request is in the list (the index),
+# so when a request's priority changes, we can find it straight away and
+# just move it up or down the tree to where it now belongs.  Joining the
+# queue, leaving it, and changing priority all take time proportional to
+# log(queue length), rather than the length of the queue.
+#
+# Requests are seen in the same order as with a PriorityResource - by
+# priority, then the time of the request.
+#
+# Aging is done by an Aging_Policy.  Every interval minutes, it moves each
+# request that's waited another wait_per_level minutes up a priority level.
+# Rather than going through the whole queue each time, it keeps its own heap
+# of when each request is next due to move up, so it only ever looks at the
+# requests that are due.  For something other than moving up a level at
+# regular intervals, write a class with the same methods (see age()).  For
+# example :
+#
+#     ed_doctor = Reprioritisable_Resource(
+#         env, capacity=2, aging_policy=Aging_Policy(15, 120))
+#
+#     # A patient who's waiting gets worse
+#     ed_doctor.update_priority(req, 1)
+
+import heapq
+import itertools
+import simpy
+
+# Class representing a queue of requests kept in an indexed heap.  It has the
+# list methods SimPy uses for a resource's queue
+class Indexed_Heap_Queue:
+    def __init__(self):
+        # The heap, as a list of the requests and a list of their sort keys,
+        # and the position of each request in the lists
+        self.requests = []
+        self.keys = []
+        self.positions = {}
+
+        # Requests that are otherwise equal stay in the order they joined
+        self.counter = itertools.count()
+
+    # Method to swap the requests at two positions in the heap
+    def swap(self, i, j):
+        self.requests[i], self.requests[j] = self.requests[j], self.requests[i]
+        self.keys[i], self.keys[j] = self.keys[j], self.keys[i]
+        self.positions[self.requests[i]] = i
+        self.positions[self.requests[j]] = j
+
+    # Method to move the request at position i up the heap to where it belongs
+    def sift_up(self, i):
+        while i > 0:
+            parent = (i - 1) // 2
+
+            if self.keys[i] >= self.keys[parent]:
+                break
+
+            self.swap(i, parent)
+            i = parent
+
+    # Method to move the request at position i down the heap to where it
+    # belongs
+    def sift_down(self, i):
+        length = len(self.requests)
+
+        while True:
+            smallest = i
+
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < length and self.keys[child] < self.keys[smallest]:
+                    smallest = child
+
+            if smallest == i:
+                break
+
+            self.swap(i, smallest)
+            i = smallest
+
+    def append(self, request):
+        self.requests.append(request)
+        self.keys.append((request.priority, request.time, not request.preempt,
+                          next(self.counter)))
+        self.positions[request] = len(self.requests) - 1
+
+        self.sift_up(len(self.requests) - 1)
+
+    # Method to change the priority of a request in the queue
+    def update(self, request, priority):
+        i = self.positions[request]
+        old_key = self.keys[i]
+        self.keys[i] = (priority,) + old_key[1:]
+
+        if self.keys[i] < old_key:
+            self.sift_up(i)
+        else:
+            self.sift_down(i)
+
+    # Method to take a request out of the queue, by moving the last request
+    # in the heap in to its place, and then up or down to where it belongs
+    def remove(self, request):
+        i = self.positions.pop(request)
+        last_request = self.requests.pop()
+        last_key = self.keys.pop()
+
+        if i < len(self.requests):
+            self.requests[i] = last_request
+            self.keys[i] = last_key
+            self.positions[last_request] = i
+
+            self.sift_up(i)
+            self.sift_down(self.positions[last_request])
+
+    # SimPy only ever looks at, and takes, the request at the front of the
+    # queue, which is quick.  Anywhere else means sorting the queue
+    def pop(self, index=-1):
+        request = self[index]
+        self.remove(request)
+
+        return request
+
+    def __getitem__(self, index):
+        if index == 0 and self.requests:
+            return self.requests[0]
+
+        return list(self)[index]
+
+    def __contains__(self, request):
+        return request in self.positions
+
+    def __len__(self):
+        return len(self.requests)
+
+    def __iter__(self):
+        order = sorted(range(len(self.requests)), key=self.keys.__getitem__)
+
+        return iter([self.requests[i] for i in order])
+
+# Class representing a policy that moves waiting requests up a priority level
+# for every wait_per_level minutes they wait, up to highest_priority, checking
+# every interval minutes
+class Aging_Policy:
+    def __init__(self, interval, wait_per_level, highest_priority=1):
+        self.interval = interval
+        self.wait_per_level = wait_per_level
+        self.highest_priority = highest_priority
+
+        # A heap of (time due to move up, order, request)
+        self.due = []
+        self.counter = itertools.count()
+
+    # Method the resource calls when a request joins its queue
+    def request_queued(self, request):
+        if request.priority > self.highest_priority:
+            heapq.heappush(self.due, (request.time + self.wait_per_level,
+                                      next(self.counter), request))
+
+    # A generator function that ages the resource's queue every interval
+    def run(self, resource):
+        while True:
+            yield resource.env.timeout(self.interval)
+            self.age(resource)
+
+    # Method to move up every request that's due.  Requests that have left
+    # the queue since they were added are just skipped
+    def age(self, resource):
+        now = resource.env.now
+
+        while self.due and self.due[0][0] <= now:
+            due_time, _, request = heapq.heappop(self.due)
+
+            if request not in resource.put_queue:
+                continue
+
+            resource.update_priority(request, request.priority - 1)
+
+            if request.priority > self.highest_priority:
+                heapq.heappush(self.due, (due_time + self.wait_per_level,
+                                          next(self.counter), request))
+
+# Class representing a PriorityResource whose queued requests can have their
+# priority changed, with an optional aging policy
+class Reprioritisable_Resource(simpy.PriorityResource):
+    def __init__(self, env, capacity=1, aging_policy=None):
+        super().__init__(env, capacity)
+
+        self.env = env
+        self.put_queue = Indexed_Heap_Queue()
+        self.queue = self.put_queue
+        self.aging_policy = aging_policy
+
+        if aging_policy is not None:
+            env.process(aging_policy.run(self))
+
+    def request(self, priority=0, preempt=True):
+        request = simpy.resources.resource.PriorityRequest(self, priority,
+                                                           preempt)
+
+        # Requests that have to wait are passed to the aging policy
+        if not request.triggered and self.aging_policy is not None:
+            self.aging_policy.request_queued(request)
+
+        return request
+
+    # Method to change the priority of a request.  If it's still waiting,
+    # it moves to its new place in the queue
+    def update_priority(self, request, priority):
+        if request in self.put_queue:
+            self.put_queue.update(request, priority)
+
+        request.priority = priority
+        request.key = (priority,) + request.key[1:]
@@ -0,0 +1,197 @@
+# RESULT CACHE
+# When we're building a report, we often run exactly the same runs of the
+# same scenarios again and again.  As every run is repeatable (its random
+# numbers only depend on the master seed and the run number - see
+# rng_streams.py), there's no need to simulate it again - we can save its
+# results the first time, and look them up after that.
+#
+# Each run's results are saved in a file in the cache directory, named after
+# a hash of everything that could change them :
+# - which model it is (the file it's in and the name of the class)
+# - a hash of the code in the model's file, and in every file from the same
+#   directory that it uses (directly or not), like rng_streams.py, so that
+#   changing the model automatically means its old results aren't used any
+#   more
+# - the parameters in the scenario (see scenario.py) that describe the
+#   system being modelled - not the trial settings, like the number of runs
+#   or where the results are written, which don't change a run's results
+# - the master seed and the run number
+# - the warm up and simulation durations
+#
+# The cache has a maximum size.  When it's full, the results that were used
+# least recently are deleted to make room (LRU - Least Recently Used).  We
+# keep track of when each file was last used by updating its modification
+# time whenever we read it.
+
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sys
+import tempfile
+from scenario import TRIAL_SETTINGS, json_default
+
+# The code hash of each model class we've seen, so we only need to read the
+# model's files once
+code_hashes = {}
+
+# Function to find the files of a module, and of every module from the same
+# directory it uses - either imported itself, or the module a class or
+# function it imported comes from - and the modules they use, and so on.
+# Returns a dictionary of the files, by module name
+def local_module_files(module):
+    directory = os.path.dirname(os.path.abspath(module.__file__))
+    module_files = {}
+    modules_to_check = [module]
+
+    while modules_to_check:
+        module = modules_to_check.pop()
+
+        if module.__name__ in module_files:
+            continue
+
+        module_files[module.__name__] = module.__file__
+
+        for value in vars(module).values():
+            if inspect.ismodule(value):
+                used_module = value
+            else:
+                module_name = getattr(value, "__module__", None)
+                used_module = (sys.modules.get(module_name)
+                               if isinstance(module_name, str) else None)
+
+            used_file = getattr(used_module, "__file__", None)
+
+            if (used_file is not None and
+                    os.path.dirname(os.path.abspath(used_file)) == directory):
+                modules_to_check.append(used_module)
+
+    return module_files
+
+# Function to work out a hash of the code in the file a model class is in,
+# and in the files from the same directory it uses
+def model_code_hash(model_class):
+    if model_class not in code_hashes:
+        module_files = local_module_files(sys.modules[model_class.__module__])
+        code_hash = hashlib.sha256()
+
+        # The same model can be imported under different names (e.g. as
+        # __main__, and by name in a worker process), so we go by file name
+        for path in sorted(module_files.values(), key=os.path.basename):
+            with open(path, "rb") as f:
+                code_hash.update(os.path.basename(path).encode())
+                code_hash.update(hashlib.sha256(f.read()).digest())
+
+        code_hashes[model_class] = code_hash.hexdigest()
+
+    return code_hashes[model_class]
+
+# Class representing a cache of run results (each run's run summary) in a
+# directory on disk
+class Result_Cache:
+    def __init__(self, directory="result_cache", max_bytes=500_000_000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        os.makedirs(directory, exist_ok=True)
+
+    # Method to work out the key for a model that's been set up for a run
+    # (but not run yet).  The master seed and warm up duration the model is
+    # actually using are part of the key, so we leave out the defaults for
+    # them in the scenario, along with any trial settings
+    def key(self, model):
+        model_class = type(model)
+        scenario = model.scenario
+
+        model_parameters = {
+            name:value for name, value in scenario.to_dict().items()
+            if name not in TRIAL_SETTINGS
+            and name not in ("master_seed", "warm_up_duration")}
+
+        key_parts = [os.path.basename(inspect.getsourcefile(model_class)),
+                     model_class.__qualname__,
+                     model_code_hash(model_class),
+                     model_parameters,
+                     model.rng.master_seed,
+                     model.run_number,
+                     getattr(model, "warm_up_duration", 0),
+                     scenario.sim_duration]
+
+        return hashlib.sha256(
+            json.dumps(key_parts, sort_keys=True,
+                       default=json_default).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    # Method to look up the results saved under a key.  Returns a dictionary
+    # with the run summary, or None if they're not in the cache
+    def get(self, key):
+        try:
+            with open(self.path(key), "rb") as f:
+                results = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+        # Mark the results as just used
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            pass
+
+        return results
+
+    # Method to save results under a key.  We write to a temporary file and
+    # then rename it, so another process never sees a half written file
+    def put(self, key, results):
+        file_descriptor, temporary_path = tempfile.mkstemp(
+            dir=self.directory, suffix=".tmp")
+
+        with os.fdopen(file_descriptor, "wb") as f:
+            pickle.dump(results, f)
+
+        os.replace(temporary_path, self.path(key))
+
+        self.evict()
+
+    # Method to delete the least recently used results until the cache is
+    # back under its maximum size
+    def evict(self):
+        entries = []
+
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            total_bytes -= size
+
+    # Method to run a model that's been set up for a run, unless its results
+    # are already in the cache.  Returns the run summary either way
+    def run(self, model):
+        key = self.key(model)
+        results = self.get(key)
+
+        if results is not None:
+            return results["summary"]
+
+        model.run()
+        results = {"summary":model.get_run_summary()}
+        self.put(key, results)
+
+        return results["summary"]
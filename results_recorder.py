@@ -0,0 +1,92 @@
+# RECORDING PATIENT LEVEL RESULTS
+# Building a one row Pandas DataFrame for every patient and concatenating it
+# on to the end of our results DataFrame is easy to read, but it's slow -
+# every pd.concat copies the whole of the DataFrame so far, so the time it
+# takes to store results grows with the square of the number of patients.
+#
+# Instead, we can store each column of results in a NumPy array that's bigger
+# than we need, and just fill in the next row each time a patient's results
+# come in.  The arrays start with room for 1024 patients (so a run with
+# fewer than that never needs more), and when they fill up, we swap them for
+# arrays twice the size - so this happens rarely (only 10 times for a million
+# patients).  At the end of the run, we turn the arrays into a DataFrame in
+# one go.
+#
+# Each column starts out filled with NaN (Not a Number), so any queuing time
+# we don't record for a patient (e.g. the ED assessment queue for a patient
+# that went to the ACU) is automatically left as NaN.
+
+import numpy as np
+import pandas as pd
+
+# Class to store patient level results in growable NumPy arrays, one per
+# column, alongside an array of patient IDs
+class Results_Recorder:
+    def __init__(self, index_column, columns, initial_capacity=1024):
+        self.index_column = index_column
+        self.columns = list(columns)
+
+        self.number_of_rows = 0
+        self.capacity = initial_capacity
+
+        self.index_values = np.zeros(self.capacity, dtype=np.int64)
+        self.column_values = {column:np.full(self.capacity, np.nan)
+                              for column in self.columns}
+
+    def __len__(self):
+        return self.number_of_rows
+
+    # Method to double the size of the arrays when they're full, keeping the
+    # values stored so far
+    def grow(self):
+        self.capacity *= 2
+
+        index_values = np.zeros(self.capacity, dtype=np.int64)
+        index_values[:self.number_of_rows] = self.index_values
+        self.index_values = index_values
+
+        for column in self.columns:
+            column_values = np.full(self.capacity, np.nan)
+            column_values[:self.number_of_rows] = self.column_values[column]
+            self.column_values[column] = column_values
+
+    # Method to record the results for a patient.  The values are passed in
+    # as keyword arguments named after the columns - any column we don't
+    # pass a value for is left as NaN
+    def record(self, index_value, **values):
+        if self.number_of_rows == self.capacity:
+            self.grow()
+
+        row = self.number_of_rows
+        self.index_values[row] = index_value
+
+        for column, value in values.items():
+            self.column_values[column][row] = value
+
+        self.number_of_rows += 1
+
+    # Method to get the values stored so far in a column (this is a view on
+    # to the array, rather than a copy)
+    def column(self, column):
+        return self.column_values[column][:self.number_of_rows]
+
+    # Method to take the mean of a column, ignoring NaNs in the same way that
+    # Pandas does.  If there are no values at all, we return NaN
+    def mean(self, column):
+        values = self.column(column)
+        values = values[~np.isnan(values)]
+
+        if len(values) == 0:
+            return float("nan")
+
+        return values.mean()
+
+    # Method to turn the results into a Pandas DataFrame, indexed by the
+    # index column.  We only need to call this once, at the end of a run
+    def to_dataframe(self):
+        results_df = pd.DataFrame(
+            {column:self.column(column).copy() for column in self.columns},
+            index=pd.Index(self.index_values[:self.number_of_rows].copy(),
+                           name=self.index_column))
+
+        return results_df
@@ -0,0 +1,105 @@
+# RANDOM NUMBER STREAMS
+# If every part of a model draws its random numbers from Python's global
+# random module, then everything is tangled together - change how many
+# patients go to the ACU, and the service times sampled for every patient
+# after that change too.  It also means a run can't be repeated, unless you
+# run it in exactly the same order in exactly the same process.
+#
+# Instead, we give each run of a model its own RNG (random number generator)
+# context.  From this, each activity in the model (arrivals, registration,
+# triage etc) gets its own stream of random numbers.  Each stream is seeded
+# from three things - the master seed for the trial, the run number and the
+# name of the stream - using NumPy's SeedSequence, which is designed to turn
+# related inputs like these into seeds for statistically independent streams.
+#
+# This means that :
+# - any run can be repeated on its own, in any process, just by giving it the
+#   same master seed and run number
+# - changing what happens in one activity doesn't change the random numbers
+#   used by any of the others
+#
+# Asking NumPy for one random number at a time is slow, but asking it for
+# thousands at once is almost as quick as asking for one.  So each stream
+# samples its random numbers in blocks, and hands them out one at a time,
+# sampling a new block whenever it runs out.  The model code doesn't need to
+# know about this - a stream has the same expovariate(), uniform() and
+# randint() methods as Python's random module.
+
+import zlib
+import numpy as np
+
+# Class representing a single stream of random numbers, drawn in blocks from
+# a NumPy random number generator.  We keep separate blocks of exponential
+# and uniform random numbers, and turn these into the distributions we need
+# (e.g. an exponential with a given mean is just a standard exponential
+# multiplied by the mean)
+class Block_Stream:
+    def __init__(self, seed_sequence, block_size=4096):
+        self.generator = np.random.Generator(np.random.PCG64(seed_sequence))
+        self.block_size = block_size
+
+        self.exponentials = []
+        self.next_exponential = 0
+
+        self.uniforms = []
+        self.next_uniform = 0
+
+    # Method to get the next standard exponential (mean 1) random number,
+    # sampling a new block if we've used them all up
+    def standard_exponential(self):
+        if self.next_exponential == len(self.exponentials):
+            self.exponentials = self.generator.standard_exponential(
+                self.block_size).tolist()
+            self.next_exponential = 0
+
+        value = self.exponentials[self.next_exponential]
+        self.next_exponential += 1
+
+        return value
+
+    # Method to get the next uniform random number between 0 and 1, sampling
+    # a new block if we've used them all up
+    def random(self):
+        if self.next_uniform == len(self.uniforms):
+            self.uniforms = self.generator.random(self.block_size).tolist()
+            self.next_uniform = 0
+
+        value = self.uniforms[self.next_uniform]
+        self.next_uniform += 1
+
+        return value
+
+    # Methods matching those in Python's random module
+    def expovariate(self, lambd):
+        return self.standard_exponential() / lambd
+
+    def uniform(self, a, b):
+        return a + (b - a) * self.random()
+
+    def randint(self, a, b):
+        return a + int(self.random() * (b - a + 1))
+
+# Class representing the random number streams for a single run of a model.
+# Streams are created the first time they're asked for, so we don't need to
+# list them in advance (and adding a new stream doesn't change the others)
+class RNG_Context:
+    def __init__(self, master_seed, run_number):
+        self.master_seed = master_seed
+        self.run_number = run_number
+        self.streams = {}
+
+    # Method to work out the seed for a named stream.  We turn the name into
+    # a number using a CRC32 checksum (unlike Python's built in hash(), this
+    # gives the same number every time the program runs)
+    def seed_for_stream(self, name):
+        return np.random.SeedSequence(
+            self.master_seed,
+            spawn_key=(self.run_number, zlib.crc32(name.encode())))
+
+    # Method to get the named stream.  This behaves just like the random
+    # module, so we can call stream.expovariate(), stream.uniform() etc on it
+    def stream(self, name):
+        if name not in self.streams:
+            self.streams[name] = Block_Stream(self.seed_for_stream(name))
+
+        return self.streams[name]
@@ -0,0 +1,143 @@
+# RESOURCES THAT FOLLOW A ROTA
+# One way to model staff going off shift is to have a process request one of
+# them with a top priority, and hold on to them for the time they're away.
+# That works, but each of these "phantom" requests sits in the queue
+# alongside the real patients, and gets sorted against them, and a real rota
+# with dozens of changes a day means dozens of phantoms.
+#
+# Rota_Resource does this directly instead.  We give it a rota - a list of
+# (time, number of servers) pairs, saying how many servers are on shift from
+# each time on, repeating every cycle_length (e.g. 1440 minutes for a daily
+# rota) - and a single process changes its capacity at each of those times.
+# Each change is one scheduled event, and never touches the queue.
+#
+# When the number of servers goes down, there are two ways to deal with
+# servers who are busy at the time :
+# - drain (the default) - they finish seeing whoever they're seeing, and
+#   then leave.  No-one new starts being seen until there are fewer busy
+#   servers than the new capacity
+# - remove immediately - they leave straight away.  Whoever they were seeing
+#   goes back in to the queue, and is seen for the rest of their time by the
+#   next server to become free.  For this to work, entities need to use
+#   hold() instead of a timeout for the time they spend being seen
+#
+# For example, 2 doctors on shift for 8 hours, then 1 for 4 hours :
+#
+#     ed_doctor = Rota_Resource(env, [(0, 2), (480, 1)], cycle_length=720)
+#
+#     with ed_doctor.request(priority=patient.priority) as req:
+#         yield req
+#         yield from ed_doctor.hold(req, sampled_ed_assess_duration)
+
+import simpy
+from bucket_queue import Bucket_Queue
+
+# Class representing a priority resource whose capacity follows a rota.  The
+# rota must start at time 0.  If cycle_length is None, the rota doesn't repeat,
+# and the last number of servers stays from then on.  If we give the
+# priorities requests can have (e.g. range(1, 6)), the queue is kept in a
+# Bucket_Queue (see bucket_queue.py), and a request without a priority gets
+# the most urgent (lowest) one
+class Rota_Resource(simpy.PriorityResource):
+    def __init__(self, env, rota, cycle_length=None, remove_immediately=False,
+                 priorities=None):
+        rota = sorted(rota)
+
+        if rota[0][0] != 0:
+            raise ValueError("The rota must start at time 0")
+
+        # SimPy doesn't allow a resource to start with a capacity of 0, so we
+        # start it with 1, then set it to the rota's first capacity
+        super().__init__(env, capacity=1)
+
+        self.env = env
+        self.rota = rota
+        self.cycle_length = cycle_length
+        self.remove_immediately = remove_immediately
+        self._capacity = rota[0][1]
+
+        self.default_priority = 0
+
+        if priorities is not None:
+            self.put_queue = Bucket_Queue(priorities)
+            self.queue = self.put_queue
+            self.default_priority = self.put_queue.lowest_priority
+
+        # The requests that are currently in hold(), and the event that tells
+        # each one its server has been removed
+        self.holding = {}
+
+        env.process(self.follow_rota())
+
+    # A generator function that changes the capacity at each time in the rota
+    def follow_rota(self):
+        cycle_start = self.env.now
+
+        while True:
+            for change_time, capacity in self.rota:
+                if cycle_start + change_time > self.env.now:
+                    yield self.env.timeout(
+                        cycle_start + change_time - self.env.now)
+
+                self.set_capacity(capacity)
+
+            if self.cycle_length is None:
+                return
+
+            cycle_start += self.cycle_length
+
+    def request(self, priority=None, preempt=True):
+        if priority is None:
+            priority = self.default_priority
+
+        return super().request(priority, preempt)
+
+    # Method to change the number of servers
+    def set_capacity(self, capacity):
+        self._capacity = capacity
+
+        # If servers leave straight away, remove them from the lowest
+        # priority requests that are being held, latest started first
+        if self.remove_immediately:
+            while len(self.users) > capacity and self.holding:
+                request = max(self.holding, key=lambda request: (
+                    request.priority, request.usage_since))
+
+                self.users.remove(request)
+                self.holding.pop(request).succeed()
+
+        # If there are more servers now, requests in the queue can start (SimPy
+        # starts one request each time we ask it to)
+        while len(self.users) < capacity and self.put_queue:
+            self._trigger_put(None)
+
+    # A generator function that holds on to a server for the given time, once
+    # the request has been met.  If the server is removed part way through,
+    # we queue again (with the same priority) for the rest of the time
+    def hold(self, request, duration):
+        if not self.remove_immediately:
+            yield self.env.timeout(duration)
+            return
+
+        original_request = request
+
+        while True:
+            start_time = self.env.now
+            removal = self.env.event()
+            self.holding[request] = removal
+
+            yield self.env.timeout(duration) | removal
+
+            self.holding.pop(request, None)
+            duration -= self.env.now - start_time
+
+            if not removal.triggered or duration <= 0:
+                break
+
+            request = self.request(priority=original_request.priority)
+            yield request
+
+        # The original request is released when its with block ends, but any
+        # request made here needs releasing here
+        if request is not original_request:
+            self.release(request)
@@ -0,0 +1,170 @@
+# SCENARIOS
+# Our models read their parameters from the g class.  That's simple, but the g
+# class belongs to the whole program - if we change g.number_of_nurses to try
+# out a different scenario, every model in the program sees the change, so we
+# can't run two scenarios side by side (e.g. in two threads).
+#
+# A Scenario holds a set of parameter values that can't be changed once it's
+# been created.  A model is given its own scenario when it's created, and
+# reads its parameters from that instead of from g.  To try out a different
+# scenario, we make a new one with replace(), which copies the original and
+# changes just the parameters we ask it to.
+#
+# Because a scenario can't change, we can also work out a hash of its
+# contents - a short string that's the same every time for the same
+# parameter values, and (in practice) different for any other values.  This
+# can be used as a key for storing and looking up results.
+#
+# Lists, dictionaries and sets in the parameter values (e.g. a table of
+# arrival rates) are turned in to tuples, read only dictionaries and frozen
+# sets when the scenario is created, so they can't be changed afterwards
+# either.
+#
+# The g class also has settings that control how a trial is run (how many
+# runs, where the results go etc.) rather than the system being modelled.
+# These aren't part of a scenario made from the g class, so changing them
+# doesn't change the scenario, or its hash.
+
+import hashlib
+import json
+from collections.abc import Mapping
+from types import MappingProxyType
+
+# Parameters of the g class that control how a trial is run, rather than the
+# system being modelled
+TRIAL_SETTINGS = {"number_of_runs", "number_of_workers", "target_precision",
+                  "confidence", "min_runs", "max_runs", "trial_results_file",
+                  "auto_warm_up", "number_of_pilot_runs",
+                  "fork_after_warm_up", "result_cache_directory",
+                  "sweep_parameters", "sweep_results_file", "engine"}
+
+# Function to make a copy of a parameter value that can't be changed
+def freeze(value):
+    if isinstance(value, Mapping):
+        return MappingProxyType({key:freeze(item)
+                                 for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(item) for item in value)
+
+    return value
+
+# Function to turn a frozen parameter value back in to plain dictionaries and
+# lists (e.g. so it can be pickled, or written as JSON)
+def thaw(value):
+    if isinstance(value, Mapping):
+        return {key:thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    if isinstance(value, frozenset):
+        return {thaw(item) for item in value}
+
+    return value
+
+# Function to write a value that can't be written as JSON when working out a
+# hash.  Sets are written in a fixed order, and anything else (which
+# shouldn't really be in a scenario) using repr()
+def json_default(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+
+    return repr(value)
+
+# Class representing a set of parameter values.  Parameters are read as
+# attributes, just like with the g class (e.g. scenario.number_of_nurses), and
+# a scenario can also be used like a (read only) dictionary
+class Scenario(Mapping):
+    __slots__ = ("_parameters", "_content_hash")
+
+    def __init__(self, **parameters):
+        object.__setattr__(self, "_parameters",
+                           {name:freeze(value) for name, value
+                            in sorted(parameters.items())})
+        object.__setattr__(self, "_content_hash", None)
+
+    # Method to create a scenario from a class of parameter values, like g.
+    # Every attribute that isn't a method, doesn't start with _ and isn't a
+    # trial setting is used
+    @classmethod
+    def from_class(cls, params):
+        return cls(**{name:value for name, value in vars(params).items()
+                      if not name.startswith("_") and not callable(value)
+                      and name not in TRIAL_SETTINGS})
+
+    # Method to create a scenario from a dictionary of parameter values
+    @classmethod
+    def from_dict(cls, parameters):
+        return cls(**parameters)
+
+    # Method to make a copy of the scenario with some of the parameters
+    # changed, e.g. scenario.replace(number_of_nurses=3)
+    def replace(self, **changes):
+        for name in changes:
+            if name not in self._parameters:
+                raise TypeError(f"Scenario has no parameter called {name}")
+
+        return self.from_dict({**self._parameters, **changes})
+
+    # Method to get the parameter values as a plain dictionary, with any
+    # frozen values turned back in to dictionaries and lists
+    def to_dict(self):
+        return {name:thaw(value) for name, value in self._parameters.items()}
+
+    # A hash of the scenario's parameter values, written as JSON with the
+    # keys of every dictionary sorted, so the order they were given in
+    # doesn't matter
+    @property
+    def content_hash(self):
+        if self._content_hash is None:
+            content = json.dumps(self.to_dict(), sort_keys=True,
+                                 default=json_default)
+            object.__setattr__(self, "_content_hash",
+                               hashlib.sha256(content.encode()).hexdigest())
+
+        return self._content_hash
+
+    def __getattr__(self, name):
+        try:
+            return self._parameters[name]
+        except KeyError:
+            raise AttributeError(
+                f"Scenario has no parameter called {name}") from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("A scenario can't be changed - use replace() " +
+                             "to make a new one")
+
+    def __delattr__(self, name):
+        raise AttributeError("A scenario can't be changed - use replace() " +
+                             "to make a new one")
+
+    def __getitem__(self, name):
+        return self._parameters[name]
+
+    def __iter__(self):
+        return iter(self._parameters)
+
+    def __len__(self):
+        return len(self._parameters)
+
+    def __eq__(self, other):
+        if not isinstance(other, Scenario):
+            return NotImplemented
+
+        return self._parameters == other._parameters
+
+    def __hash__(self):
+        return hash(self.content_hash)
+
+    def __repr__(self):
+        parameters = ", ".join(f"{name}={value!r}"
+                               for name, value in self._parameters.items())
+
+        return f"Scenario({parameters})"
+
+    # Scenarios are sent to worker processes by pickling them, which would
+    # otherwise try (and fail) to set their attributes directly (and can't
+    # pickle read only dictionaries)
+    def __reduce__(self):
+        return (self.__class__.from_dict, (self.to_dict(),))
@@ -0,0 +1,123 @@
+# SCENARIO SWEEPS
+# A lot of the questions we ask of a model are "what if" questions - what if
+# we had another receptionist, or 3 GPs instead of 2?  Rather than editing the
+# g class and rerunning the script for each one, we can describe every
+# scenario we want to try, and run them all in one go.
+#
+# Each scenario is a copy of a base scenario with some parameters changed
+# (see scenario.py).  scenario_grid() makes one for every combination of the
+# values we want to try, e.g. 3 numbers of nurses x 2 numbers of doctors = 6
+# scenarios.  run_sweep() then runs every run of every scenario across a pool
+# of worker processes, and puts all of the run summaries in a single table,
+# with a row per run of each scenario.
+#
+# Some scenarios run much more slowly than others (e.g. one with very long
+# queues has many more patients in the system at once).  To stop the workers
+# sitting idle while one of them works through a slow scenario on its own at
+# the end, we hand out runs one at a time (so whichever worker is free next
+# takes the next run), and we hand them out a run of every scenario at a time
+# (run 0 of every scenario, then run 1 of every scenario, and so on), so the
+# slow runs are spread out through the sweep rather than bunched together.
+
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+
+# Function to make a scenario for every combination of the given parameter
+# values, e.g. scenario_grid(base, number_of_nurses=[1, 2, 3]).  The
+# scenarios are in the same order as itertools.product would give
+def scenario_grid(base_scenario, **parameter_values):
+    names = list(parameter_values)
+
+    return [base_scenario.replace(**dict(zip(names, values)))
+            for values in itertools.product(*parameter_values.values())]
+
+# Function that carries out a single run of a scenario (or looks its results
+# up in the result cache, if we've given it one).  This is what gets sent to
+# each worker process, so it needs to be a module level function
+def run_scenario_replication(model_class, master_seed, model_kwargs,
+                             scenario, run_number, result_cache=None):
+    model = model_class(run_number, master_seed, scenario=scenario,
+                        **model_kwargs)
+
+    if result_cache is not None:
+        return result_cache.run(model)
+
+    model.run()
+
+    return model.get_run_summary()
+
+# Function to run number_of_runs runs of each of the scenarios across a pool
+# of worker processes.  The model class works in the same way as for
+# replication_runner, but must also take a scenario.  Returns a DataFrame
+# with a row for every run of every scenario, with the number of the
+# scenario (its position in the list), its content hash, the value of each
+# of the parameter_names (by default, each parameter that differs between
+# the scenarios), and the run summary.  Parts of the run summary that aren't
+# single values (e.g. quantile sketches) are left out
+def run_sweep(model_class, scenarios, number_of_runs, master_seed=42,
+              number_of_workers=None, model_kwargs=None, result_cache=None,
+              parameter_names=None):
+    # With no scenarios, there's nothing to run (or to find the parameters
+    # that differ in)
+    if not scenarios:
+        return pd.DataFrame(columns=["Scenario", "Scenario_Hash",
+                                     *(parameter_names or [])])
+
+    if number_of_workers is None:
+        number_of_workers = os.cpu_count() or 1
+
+    model_kwargs = model_kwargs or {}
+    scenario_runs = [(scenario_number, run_number)
+                     for run_number in range(number_of_runs)
+                     for scenario_number in range(len(scenarios))]
+    run_summaries = {}
+
+    if number_of_workers == 1:
+        for scenario_number, run_number in scenario_runs:
+            run_summaries[(scenario_number, run_number)] = (
+                run_scenario_replication(model_class, master_seed,
+                                         model_kwargs,
+                                         scenarios[scenario_number],
+                                         run_number, result_cache))
+    else:
+        with ProcessPoolExecutor(max_workers=number_of_workers) as pool:
+            runs_in_progress = {
+                pool.submit(run_scenario_replication, model_class,
+                            master_seed, model_kwargs,
+                            scenarios[scenario_number], run_number,
+                            result_cache):(scenario_number, run_number)
+                for scenario_number, run_number in scenario_runs}
+
+            for run_in_progress in as_completed(runs_in_progress):
+                run_summaries[runs_in_progress[run_in_progress]] = (
+                    run_in_progress.result())
+
+    # The parameters that differ between the scenarios, unless we've said
+    # which ones we want
+    if parameter_names is None:
+        swept_parameters = [name for name in scenarios[0]
+                            if len({repr(scenario[name])
+                                    for scenario in scenarios}) > 1]
+    else:
+        swept_parameters = list(parameter_names)
+
+    rows = []
+
+    for scenario_number, run_number in sorted(run_summaries):
+        scenario = scenarios[scenario_number]
+        row = {"Scenario":scenario_number,
+               "Scenario_Hash":scenario.content_hash}
+
+        for name in swept_parameters:
+            row[name] = scenario[name]
+
+        for name, value in run_summaries[(scenario_number,
+                                          run_number)].items():
+            if not isinstance(value, (dict, list, tuple)):
+                row[name] = value
+
+        rows.append(row)
+
+    return pd.DataFrame(rows)
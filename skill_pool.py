@@ -0,0 +1,167 @@
+# SKILL BASED POOLS OF STAFF
+# In the ED model, ED doctors and ACU doctors are two separate resources, and
+# each patient queues for one or the other.  In practice, some clinicians can
+# cover both.  A Skill_Pool is a single pool of staff (servers), where each
+# server has a set of skills, and each request says which skills it needs -
+# it can be met by any server who has all of them.  For example, 2 ED
+# doctors, 1 ACU doctor, and 1 doctor who can do either :
+#
+#     doctors = Skill_Pool(env, [{"ED"}, {"ED"}, {"ACU"}, {"ED", "ACU"}])
+#     ed_doctor = doctors.resource({"ED"})
+#     acu_doctor = doctors.resource({"ACU"})
+#
+#     with ed_doctor.request() as req:
+#         yield req
+#
+# With dozens of staff, we don't want to look through every server to find
+# one that's free, or through every waiting request whenever a server
+# finishes.  Servers with the same skills are interchangeable, so we group
+# them in to types, and keep a list of the idle servers of each type.  A
+# new request goes to an idle server of the least flexible type that has the
+# skills it needs (so the staff who can do the most are kept free for
+# whoever needs them), and otherwise waits in a first come first served
+# queue with the other requests needing the same skills.  When a server
+# finishes, they take whoever has been waiting longest out of the queues
+# they can help with, just by looking at the front of each.  Which types can
+# meet each set of skills, and which queues each type can help with, are only
+# worked out once.
+
+from collections import deque
+import itertools
+import simpy
+
+# Class representing a request for a server with the given skills.  It's an
+# event that triggers when the request is met, with the number of the server
+# in server
+class Skill_Request(simpy.Event):
+    def __init__(self, pool, skills):
+        super().__init__(pool.env)
+
+        self.pool = pool
+        self.skills = frozenset(skills)
+        self.order = next(pool.counter)
+        self.server = None
+
+        pool.put(self)
+
+    # As with a SimPy request, leaving the with block releases the server (or
+    # leaves the queue, if the request hasn't been met yet)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.triggered:
+            self.pool.release(self)
+        else:
+            self.cancel()
+
+    # Method to leave the queue without being seen
+    def cancel(self):
+        if not self.triggered:
+            self.pool.queue_for(self.skills).remove(self)
+
+# Class representing a view of a Skill_Pool for requests needing the given
+# skills, which can be used in the same way as a SimPy Resource
+class Skill_Pool_Resource:
+    def __init__(self, pool, skills):
+        self.pool = pool
+        self.skills = frozenset(skills)
+
+    def request(self):
+        return Skill_Request(self.pool, self.skills)
+
+    def release(self, request):
+        self.pool.release(request)
+
+    # The requests waiting for these skills
+    @property
+    def queue(self):
+        return self.pool.queue_for(self.skills)
+
+# Class representing a pool of servers, each with the skills in the list of
+# servers (e.g. [{"ED"}, {"ED", "ACU"}])
+class Skill_Pool:
+    def __init__(self, env, servers):
+        self.env = env
+        self.server_skills = [frozenset(skills) for skills in servers]
+
+        # The idle servers of each type (set of skills).  The types are kept
+        # in order of how flexible they are, fewest skills first
+        self.idle = {}
+
+        for server, skills in enumerate(self.server_skills):
+            self.idle.setdefault(skills, []).append(server)
+
+        self.server_types = sorted(self.idle, key=lambda skills: (
+            len(skills), sorted(skills)))
+
+        for servers_of_type in self.idle.values():
+            servers_of_type.reverse()
+
+        # The queue for each set of skills needed, the types of server that
+        # can meet each set of skills, and the queues each type can help with
+        self.queues = {}
+        self.types_for_skills = {}
+        self.queues_for_type = {skills:[] for skills in self.server_types}
+
+        self.counter = itertools.count()
+        self.count = 0
+
+    def resource(self, skills):
+        return Skill_Pool_Resource(self, skills)
+
+    def request(self, skills):
+        return Skill_Request(self, skills)
+
+    # Method to get the queue for a set of skills, setting it up (and
+    # working out which types of server can help with it) the first time
+    def queue_for(self, skills):
+        if skills not in self.queues:
+            self.queues[skills] = deque()
+            self.types_for_skills[skills] = [
+                server_type for server_type in self.server_types
+                if skills <= server_type]
+
+            for server_type in self.types_for_skills[skills]:
+                self.queues_for_type[server_type].append(self.queues[skills])
+
+        return self.queues[skills]
+
+    # Method to give a request to the server
+    def start(self, request, server):
+        request.server = server
+        self.count += 1
+        request.succeed()
+
+    # Method for a new request to take an idle server, or join the queue
+    def put(self, request):
+        queue = self.queue_for(request.skills)
+
+        for server_type in self.types_for_skills[request.skills]:
+            if self.idle[server_type]:
+                self.start(request, self.idle[server_type].pop())
+                return
+
+        queue.append(request)
+
+    # Method for a server to finish with a request, and take whoever has been
+    # waiting longest out of the queues they can help with
+    def release(self, request):
+        if request.server is None:
+            return
+
+        server = request.server
+        request.server = None
+        self.count -= 1
+
+        longest_waiting_queue = None
+
+        for queue in self.queues_for_type[self.server_skills[server]]:
+            if queue and (longest_waiting_queue is None or
+                          queue[0].order < longest_waiting_queue[0].order):
+                longest_waiting_queue = queue
+
+        if longest_waiting_queue is None:
+            self.idle[self.server_skills[server]].append(server)
+        else:
+            self.start(longest_waiting_queue.popleft(), server)
@@ -0,0 +1,313 @@
+# STAFFING OPTIMISER
+# A common question for a model like the ED is "what's the cheapest mix of
+# staff that keeps queuing times under a target?"  Trying every combination
+# with 100 runs each works, but spends nearly all of its time on
+# combinations that are obviously far too expensive, or obviously nowhere
+# near meeting the target.
+#
+# Here, we work through the combinations from cheapest to most expensive,
+# and only spend runs where they help us decide.  For each combination, we
+# keep a confidence interval for each queuing time we've set a target for :
+# - if the whole interval is above the target for any of them, the
+#   combination is infeasible (it doesn't meet the target)
+# - if the whole interval is below the target for all of them, it's feasible
+# - otherwise we don't know yet, and need more runs
+#
+# Each round, we look at the cheapest combinations we don't know about yet.
+# Each gets a few runs to start with, and then we share out the next batch of
+# runs between them using OCBA (Optimal Computing Budget Allocation) for
+# feasibility.  This says that, overall, each combination should get runs in
+# proportion to
+#
+#     variance of its results / (mean - target) squared
+#
+# so combinations whose mean is close to the target (which need a tight
+# interval to decide), or whose results vary a lot, get more runs, and
+# clear cut ones get very few.  Each round, we work out how many runs each
+# combination should have had by the end of the round, and give the batch of
+# runs to the ones that are furthest short of that.
+#
+# Two things let us skip combinations without running them at all :
+# - once we've found a feasible combination, anything that costs more than
+#   it can't be the answer
+# - adding staff doesn't make queues longer, so if a combination is
+#   infeasible, so is every combination with no more of any type of staff
+#
+# We stop once the cheapest combination we haven't ruled out is known to be
+# feasible.  For example :
+#
+#     optimiser = Staffing_Optimiser(
+#         ED_Model, Scenario.from_class(g),
+#         {"number_of_nurses":range(1, 4), "number_of_ed_doctors":range(2, 7)},
+#         {"number_of_nurses":1, "number_of_ed_doctors":3},
+#         {"Mean_Q_Time_ED_Assessment":60})
+#     best = optimiser.optimise()
+
+import itertools
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from output_analysis import confidence_interval
+from scenario_sweep import run_scenario_replication
+
+# Function that carries out a single run of a combination's scenario.  This
+# is what gets sent to each worker process, so it needs to be a module level
+# function
+def run_combination_replication(model_class, master_seed, model_kwargs,
+                                result_cache, scenario_run):
+    scenario, run_number = scenario_run
+
+    return run_scenario_replication(model_class, master_seed, model_kwargs,
+                                    scenario, run_number, result_cache)
+
+# Class representing a single combination of staff, and the results of its
+# runs so far
+class Staffing_Combination:
+    def __init__(self, staffing, cost, scenario, metrics):
+        self.staffing = staffing
+        self.cost = cost
+        self.scenario = scenario
+        self.results = {metric:[] for metric in metrics}
+        self.status = "unknown"
+
+    @property
+    def number_of_runs(self):
+        return len(next(iter(self.results.values())))
+
+    # Method to check whether every type of staff in this combination is no
+    # more than in the other combination
+    def no_more_staff_than(self, other):
+        return all(self.staffing[name] <= other.staffing[name]
+                   for name in self.staffing)
+
+# Class representing a staffing optimiser for a model.  staffing_ranges gives
+# the numbers of each type of staff to try, staff_costs the cost of each
+# member of staff of each type, and targets the highest acceptable value of
+# each metric in the run summary (e.g. mean queuing times).  Each combination
+# gets initial_runs runs to start with, then a share of runs_per_round runs
+# each round, up to max_runs (after which we decide on its means alone)
+class Staffing_Optimiser:
+    def __init__(self, model_class, base_scenario, staffing_ranges,
+                 staff_costs, targets, initial_runs=5, runs_per_round=20,
+                 max_runs=100, frontier_size=8, confidence=0.95,
+                 master_seed=42, number_of_workers=None, model_kwargs=None,
+                 result_cache=None):
+        self.model_class = model_class
+        self.targets = targets
+        self.initial_runs = initial_runs
+        self.runs_per_round = runs_per_round
+        self.max_runs = max_runs
+        self.frontier_size = frontier_size
+        self.confidence = confidence
+        self.master_seed = master_seed
+        self.number_of_workers = number_of_workers or os.cpu_count() or 1
+        self.model_kwargs = model_kwargs or {}
+        self.result_cache = result_cache
+
+        self.total_runs = 0
+        self.combinations = []
+
+        names = list(staffing_ranges)
+
+        for numbers in itertools.product(*staffing_ranges.values()):
+            staffing = dict(zip(names, numbers))
+            cost = sum(staff_costs[name] * staffing[name] for name in names)
+
+            self.combinations.append(Staffing_Combination(
+                staffing, cost, base_scenario.replace(**staffing), targets))
+
+        self.combinations.sort(key=lambda combination: combination.cost)
+
+    # Method to carry out the given number of extra runs of each combination,
+    # e.g. {combination:5}, and store the results
+    def simulate(self, pool, runs_to_do):
+        scenario_runs = []
+        combinations = []
+
+        for combination, number_of_runs in runs_to_do.items():
+            for i in range(number_of_runs):
+                scenario_runs.append((combination.scenario,
+                                      combination.number_of_runs + i))
+                combinations.append(combination)
+
+        run_one = partial(run_combination_replication, self.model_class,
+                          self.master_seed, self.model_kwargs,
+                          self.result_cache)
+
+        if pool is None:
+            run_summaries = map(run_one, scenario_runs)
+        else:
+            run_summaries = pool.map(run_one, scenario_runs)
+
+        for combination, run_summary in zip(combinations, run_summaries):
+            for metric in self.targets:
+                combination.results[metric].append(run_summary[metric])
+
+        self.total_runs += len(scenario_runs)
+
+    # Method to decide whether a combination is feasible, infeasible, or
+    # still unknown, from the confidence intervals for each metric
+    def update_status(self, combination):
+        if combination.number_of_runs < self.initial_runs:
+            return
+
+        all_below_target = True
+
+        for metric, target in self.targets.items():
+            mean, half_width = confidence_interval(
+                combination.results[metric], self.confidence)
+
+            if combination.number_of_runs >= self.max_runs:
+                half_width = 0
+
+            if mean - half_width > target:
+                combination.status = "infeasible"
+                return
+            if not mean + half_width <= target:
+                all_below_target = False
+
+        if all_below_target:
+            combination.status = "feasible"
+        elif combination.number_of_runs >= self.max_runs:
+            # We couldn't show it meets the target (e.g. a metric with no
+            # results at all), so we can't recommend it
+            combination.status = "infeasible"
+
+    # Method to work out the OCBA weight of a combination - the variance of
+    # its results over the squared distance of its mean from the target, for
+    # whichever metric is hardest to decide
+    def ocba_weight(self, combination):
+        weight = 0.0
+
+        for metric, target in self.targets.items():
+            results = np.asarray(combination.results[metric], dtype=float)
+            results = results[~np.isnan(results)]
+
+            if len(results) < 2 or results.mean() == target:
+                return float("inf")
+
+            weight = max(weight,
+                         results.var(ddof=1) / (results.mean() - target)**2)
+
+        return weight
+
+    # Method to share out the runs for a round between the combinations in
+    # the frontier.  By the end of the round, each should have had a share
+    # of all the runs in the frontier in proportion to its OCBA weight, so
+    # we give the runs to the combinations furthest short of their share
+    def allocate_runs(self, frontier):
+        weights = {combination:self.ocba_weight(combination)
+                   for combination in frontier}
+        largest = max(weights, key=weights.get)
+
+        if weights[largest] == float("inf"):
+            return {largest:1}
+
+        total_weight = sum(weights.values())
+        total_runs = (sum(combination.number_of_runs
+                          for combination in frontier)
+                      + self.runs_per_round)
+
+        shortfalls = {}
+
+        for combination, weight in weights.items():
+            target_runs = total_runs * weight / total_weight
+            shortfalls[combination] = max(
+                0, min(target_runs, self.max_runs)
+                - combination.number_of_runs)
+
+        total_shortfall = sum(shortfalls.values())
+
+        if total_shortfall == 0:
+            return {largest:1}
+
+        runs_to_do = {}
+
+        for combination, shortfall in shortfalls.items():
+            runs_to_do[combination] = int(round(
+                self.runs_per_round * shortfall / total_shortfall))
+
+        # Make sure we always make progress
+        most_short = max(shortfalls, key=shortfalls.get)
+        runs_to_do[most_short] = max(runs_to_do[most_short], 1)
+
+        return {combination:min(number_of_runs,
+                                self.max_runs - combination.number_of_runs)
+                for combination, number_of_runs in runs_to_do.items()
+                if number_of_runs > 0}
+
+    # Method to find the cheapest feasible combination.  Returns a dictionary
+    # with the numbers of staff, the cost, the mean of each metric and the
+    # number of runs of that combination, or None if no combination is
+    # feasible.  The total number of runs used is kept in total_runs
+    def optimise(self):
+        pool = None
+
+        if self.number_of_workers > 1:
+            pool = ProcessPoolExecutor(max_workers=self.number_of_workers)
+
+        try:
+            while True:
+                # Rule out combinations with no more staff than an
+                # infeasible one
+                infeasible = [combination
+                              for combination in self.combinations
+                              if combination.status == "infeasible"]
+
+                for combination in self.combinations:
+                    if combination.status == "unknown" and any(
+                            combination.no_more_staff_than(other)
+                            for other in infeasible):
+                        combination.status = "infeasible"
+
+                # The combinations we still need to decide on are the ones
+                # cheaper than the cheapest feasible one found so far
+                best_cost = min((combination.cost
+                                 for combination in self.combinations
+                                 if combination.status == "feasible"),
+                                default=float("inf"))
+                frontier = [combination
+                            for combination in self.combinations
+                            if combination.status == "unknown"
+                            and combination.cost < best_cost]
+                frontier = frontier[:self.frontier_size]
+
+                if not frontier:
+                    break
+
+                runs_to_do = {combination:(self.initial_runs
+                                           - combination.number_of_runs)
+                              for combination in frontier
+                              if combination.number_of_runs
+                              < self.initial_runs}
+
+                if not runs_to_do:
+                    runs_to_do = self.allocate_runs(frontier)
+
+                self.simulate(pool, runs_to_do)
+
+                for combination in runs_to_do:
+                    self.update_status(combination)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        feasible = [combination for combination in self.combinations
+                    if combination.status == "feasible"]
+
+        if not feasible:
+            return None
+
+        # If more than one feasible combination has the lowest cost, take
+        # the one furthest below its targets
+        best = min(feasible, key=lambda combination: (
+            combination.cost,
+            max(confidence_interval(combination.results[metric])[0] / target
+                for metric, target in self.targets.items())))
+
+        return {**best.staffing,
+                "Cost":best.cost,
+                **{metric:confidence_interval(best.results[metric])[0]
+                   for metric in self.targets},
+                "Runs":best.number_of_runs}
@@ -0,0 +1,211 @@
+# SIMULATION SURROGATES
+# Once we've run a sweep of scenarios (see scenario_sweep.py), every new
+# question ("what about 3 nurses and 5 doctors?") still means simulating
+# again.  A surrogate (or metamodel) is a much simpler model, fitted to the
+# results of the scenarios we have simulated, that predicts the results of
+# the ones we haven't - in a fraction of a millisecond.
+#
+# The surrogate here is a Gaussian process.  It predicts the result for a new
+# scenario as a weighted average of the results we already have, giving more
+# weight to scenarios with similar parameter values.  Importantly, it also
+# tells us how uncertain that prediction is - small close to scenarios we've
+# simulated, and large far away from them.  Each simulated result is itself
+# only the mean of a few runs, so the surrogate is told how precise each one
+# is (its standard error), and doesn't try to pass exactly through noisy
+# results.
+#
+# Simulation_Surrogate puts this together with the model.  When we ask it
+# about a scenario, it answers from the surrogate if it's confident enough.
+# If not, it simulates the scenario instead, and adds the result to the
+# surrogate, so it gets better (and needs to simulate less) the more it's
+# used.  For example :
+#
+#     surrogate = Simulation_Surrogate(
+#         ED_Model, Scenario.from_class(g), "Mean_Q_Time_ED_Assessment",
+#         ["number_of_nurses", "number_of_ed_doctors"])
+#     surrogate.add_sweep_results(sweep_results_df)
+#     mean, standard_error, source = surrogate.query(number_of_nurses=3,
+#                                                    number_of_ed_doctors=5)
+
+import math
+import numpy as np
+from scenario_sweep import run_sweep
+
+# Class representing a Gaussian process regression model, with a squared
+# exponential (RBF) kernel.  Before fitting, each parameter is scaled by its
+# standard deviation, and the results are scaled to have a mean of 0 and a
+# standard deviation of 1, so a single length scale works for every
+# parameter.  The length scale, and the amount of extra noise to allow for,
+# are chosen from a small grid by maximising the log marginal likelihood
+class Gaussian_Process:
+    length_scales = [0.25, 0.5, 1.0, 2.0, 4.0]
+    extra_noises = [1e-6, 1e-3, 1e-2, 1e-1]
+
+    def __init__(self):
+        self.x = None
+
+    # The kernel - how closely related the results at two sets of (scaled)
+    # parameter values are expected to be
+    def kernel(self, x1, x2, length_scale):
+        squared_distances = ((x1[:, None, :] - x2[None, :, :])**2).sum(axis=2)
+
+        return np.exp(-0.5 * squared_distances / length_scale**2)
+
+    # Method to fit the model to parameter values x (one row per scenario),
+    # results y, and the variance of each result (e.g. its standard error
+    # squared).  Raises LinAlgError if no length scale and extra noise from
+    # the grid gives a usable fit
+    def fit(self, x, y, y_variances):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+
+        self.x_scale = x.std(axis=0)
+        self.x_scale[self.x_scale == 0] = 1
+        self.y_mean = y.mean()
+        self.y_scale = y.std() if y.std() > 0 else 1.0
+
+        self.x = x / self.x_scale
+        y_scaled = (y - self.y_mean) / self.y_scale
+        noise = np.asarray(y_variances, dtype=float) / self.y_scale**2
+
+        best_log_likelihood = -math.inf
+
+        for length_scale in self.length_scales:
+            for extra_noise in self.extra_noises:
+                covariance = (self.kernel(self.x, self.x, length_scale)
+                              + np.diag(noise + extra_noise))
+
+                try:
+                    cholesky = np.linalg.cholesky(covariance)
+                except np.linalg.LinAlgError:
+                    continue
+
+                alpha = np.linalg.solve(
+                    cholesky.T, np.linalg.solve(cholesky, y_scaled))
+                log_likelihood = (-0.5 * y_scaled @ alpha
+                                  - np.log(np.diag(cholesky)).sum())
+
+                if log_likelihood > best_log_likelihood:
+                    best_log_likelihood = log_likelihood
+                    self.length_scale = length_scale
+                    self.cholesky = cholesky
+                    self.alpha = alpha
+
+        # Even the largest extra noise didn't help (or the results have NaNs
+        # in them), so there's nothing sensible we can predict from
+        if best_log_likelihood == -math.inf:
+            raise np.linalg.LinAlgError(
+                "couldn't fit the Gaussian process to " +
+                f"{len(y)} results - the covariance matrix wasn't positive " +
+                f"definite even with extra noise of {self.extra_noises[-1]}" +
+                ", or the results or their variances aren't all finite")
+
+    # Method to predict the results at parameter values x.  Returns the
+    # predicted means and their standard deviations
+    def predict(self, x):
+        x = np.asarray(x, dtype=float) / self.x_scale
+        k = self.kernel(x, self.x, self.length_scale)
+
+        mean = self.y_mean + self.y_scale * (k @ self.alpha)
+
+        v = np.linalg.solve(self.cholesky, k.T)
+        variance = np.maximum(1 - (v**2).sum(axis=0), 0)
+
+        return mean, self.y_scale * np.sqrt(variance)
+
+# Class representing a surrogate for one result (metric) of a model, over the
+# given parameters of its scenario.  If the surrogate's standard deviation
+# for a prediction is more than max_relative_uncertainty times the predicted
+# value, we simulate the scenario instead, with number_of_runs runs.  Until
+# we've simulated at least min_scenarios scenarios, the surrogate can't tell
+# how much the results vary between scenarios, so we always simulate
+class Simulation_Surrogate:
+    def __init__(self, model_class, base_scenario, metric, parameters,
+                 number_of_runs=10, max_relative_uncertainty=0.1,
+                 min_scenarios=3, master_seed=42, number_of_workers=None,
+                 result_cache=None):
+        self.model_class = model_class
+        self.base_scenario = base_scenario
+        self.metric = metric
+        self.parameters = parameters
+        self.number_of_runs = number_of_runs
+        self.max_relative_uncertainty = max_relative_uncertainty
+        self.min_scenarios = min_scenarios
+        self.master_seed = master_seed
+        self.number_of_workers = number_of_workers
+        self.result_cache = result_cache
+
+        # The simulated results so far, keyed by the parameter values, as
+        # (mean, variance of the mean)
+        self.results = {}
+        self.gaussian_process = Gaussian_Process()
+
+    # Method to add the results of a sweep (a DataFrame from run_sweep, or
+    # one read back in from its results file) to the surrogate.  Every
+    # parameter the surrogate uses must be a column of the sweep results -
+    # any other parameters are assumed to be the same as the base scenario
+    def add_sweep_results(self, sweep_results_df):
+        for values, runs_df in sweep_results_df.groupby(self.parameters):
+            self.add_result(values, runs_df[self.metric].dropna().values)
+
+        self.fit()
+
+    # Method to add the results of the runs of one scenario
+    def add_result(self, values, run_results):
+        if len(run_results) == 0:
+            return
+
+        variance_of_mean = (np.var(run_results, ddof=1) / len(run_results)
+                            if len(run_results) > 1 else 0.0)
+
+        self.results[tuple(values)] = (float(np.mean(run_results)),
+                                       float(variance_of_mean))
+
+    def fit(self):
+        if self.results:
+            x = list(self.results)
+            y, y_variances = zip(*self.results.values())
+            self.gaussian_process.fit(x, y, y_variances)
+
+    # Method to predict the metric for the given parameter values, without
+    # simulating.  Returns the predicted value and its standard deviation
+    def predict(self, **parameter_values):
+        if len(self.results) < self.min_scenarios:
+            return math.nan, math.inf
+
+        values = [[parameter_values[name] for name in self.parameters]]
+        mean, standard_deviation = self.gaussian_process.predict(values)
+
+        return float(mean[0]), float(standard_deviation[0])
+
+    # Method to get the metric for the given parameter values, predicting it
+    # if the surrogate is confident enough, and simulating it otherwise.
+    # Returns the value, its standard deviation (or standard error, if
+    # simulated), and where it came from ("surrogate" or "simulation")
+    def query(self, **parameter_values):
+        values = tuple(parameter_values[name] for name in self.parameters)
+
+        # If we've already simulated these values, simulating them again
+        # would just give the same runs
+        if values in self.results:
+            mean, variance_of_mean = self.results[values]
+            return mean, math.sqrt(variance_of_mean), "simulation"
+
+        mean, standard_deviation = self.predict(**parameter_values)
+
+        if (standard_deviation
+                <= self.max_relative_uncertainty * abs(mean)):
+            return mean, standard_deviation, "surrogate"
+
+        scenario = self.base_scenario.replace(**parameter_values)
+        sweep_results_df = run_sweep(self.model_class, [scenario],
+                                     self.number_of_runs, self.master_seed,
+                                     self.number_of_workers,
+                                     result_cache=self.result_cache)
+
+        self.add_result(values, sweep_results_df[self.metric].dropna().values)
+        self.fit()
+
+        mean, variance_of_mean = self.results[values]
+
+        return mean, math.sqrt(variance_of_mean), "simulation"
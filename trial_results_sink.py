@@ -0,0 +1,175 @@
+# WRITING TRIAL RESULTS
+# Opening the results file, writing a single row and closing it again for
+# every run is fine for 100 runs, but for sweeps of many thousands of runs the
+# time spent opening and closing files starts to add up.  Reading the whole
+# file back in again at the end to work out the trial results is wasted
+# effort too, as we had all of those numbers in memory already.
+#
+# Instead, a trial results sink keeps the rows in memory as they come in, and
+# every batch_size rows hands a batch over to a background writer thread,
+# which keeps the file open for the whole trial and appends each batch to it.
+# The main thread never has to wait for the disk.  At the end of the trial,
+# the results are already in memory, ready to be turned into a DataFrame.
+#
+# The writer thread isn't started until the first batch is handed over (or
+# the sink is closed), so creating a sink doesn't start a thread straight
+# away.  This matters if we then use os.fork() (e.g. run_forked_replications
+# in replication_runner.py), as forking a process that has other threads
+# running isn't safe.
+#
+# The file format is chosen from the file extension :
+# - .csv gives a CSV file (as before)
+# - .arrow or .feather gives an Arrow IPC file
+# - .parquet gives a Parquet file
+# Arrow and Parquet are columnar binary formats, which are much quicker to
+# read back in than CSV for big trials.  They need the pyarrow library
+# ($ pip install pyarrow), which is only imported if we use one of them.
+
+import csv
+import os
+import queue
+import threading
+import pandas as pd
+
+# Class that buffers rows of trial results (one dictionary per run) and
+# writes them to file in batches from a background thread
+class Trial_Results_Sink:
+    def __init__(self, filename, columns, batch_size=256):
+        self.filename = filename
+        self.columns = list(columns)
+        self.batch_size = batch_size
+
+        self.file_format = self.file_format_for(filename)
+
+        # All of the results so far, stored column by column, and the rows
+        # that haven't yet been handed to the writer thread
+        self.column_values = {column:[] for column in self.columns}
+        self.pending_rows = []
+
+        self.batches_to_write = queue.Queue()
+        self.writer_error = None
+        self.writer_thread = None
+
+    # Method to start the writer thread, if it's not already running
+    def start_writer(self):
+        if self.writer_thread is None:
+            self.writer_thread = threading.Thread(target=self.write_batches,
+                                                  daemon=True)
+            self.writer_thread.start()
+
+    # Method to work out the file format from the file extension
+    def file_format_for(self, filename):
+        extension = os.path.splitext(filename)[1].lower()
+
+        if extension == ".csv":
+            return "csv"
+        if extension in (".arrow", ".feather"):
+            return "arrow"
+        if extension == ".parquet":
+            return "parquet"
+
+        raise ValueError(f"Unknown trial results file type : {extension}")
+
+    # Method to add the results of a run.  Any keys in the dictionary that
+    # aren't one of our columns are ignored
+    def write(self, row):
+        if self.writer_error is not None:
+            raise self.writer_error
+
+        for column in self.columns:
+            self.column_values[column].append(row[column])
+
+        self.pending_rows.append([row[column] for column in self.columns])
+
+        if len(self.pending_rows) >= self.batch_size:
+            self.flush()
+
+    # Method to hand any rows we've not yet written over to the writer thread
+    def flush(self):
+        if self.pending_rows:
+            self.start_writer()
+            self.batches_to_write.put(self.pending_rows)
+            self.pending_rows = []
+
+    # Method to write any remaining rows, wait for the writer thread to
+    # finish, and close the file.  The file is still written (with just the
+    # column names, for a CSV file) if there were no rows
+    def close(self):
+        self.flush()
+        self.start_writer()
+        self.batches_to_write.put(None)
+        self.writer_thread.join()
+
+        if self.writer_error is not None:
+            raise self.writer_error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Method that runs in the writer thread.  It opens the file once, writes
+    # each batch as it arrives, and closes the file when it's given None
+    # (which close() sends once there's nothing left to write)
+    def write_batches(self):
+        try:
+            if self.file_format == "csv":
+                self.write_csv_batches()
+            else:
+                self.write_arrow_batches()
+        except Exception as error:
+            self.writer_error = error
+
+            # Keep taking batches off the queue, so close() doesn't wait
+            # forever
+            while self.batches_to_write.get() is not None:
+                pass
+
+    def write_csv_batches(self):
+        with open(self.filename, "w", newline="") as f:
+            writer = csv.writer(f, delimiter=",")
+            writer.writerow(self.columns)
+
+            while (batch := self.batches_to_write.get()) is not None:
+                writer.writerows(batch)
+                f.flush()
+
+    def write_arrow_batches(self):
+        import pyarrow as pa
+        import pyarrow.ipc
+        import pyarrow.parquet
+
+        writer = None
+        schema = None
+
+        try:
+            while (batch := self.batches_to_write.get()) is not None:
+                # The schema (the type of each column) is taken from the
+                # first batch, and used for all of the batches after that
+                record_batch = pa.RecordBatch.from_pydict(
+                    {column:[row[i] for row in batch]
+                     for i, column in enumerate(self.columns)},
+                    schema=schema)
+                schema = record_batch.schema
+
+                if writer is None:
+                    if self.file_format == "arrow":
+                        writer = pa.ipc.new_file(self.filename,
+                                                 record_batch.schema)
+                    else:
+                        writer = pa.parquet.ParquetWriter(
+                            self.filename, record_batch.schema)
+
+                if self.file_format == "arrow":
+                    writer.write_batch(record_batch)
+                else:
+                    writer.write_table(pa.Table.from_batches([record_batch]))
+        finally:
+            if writer is not None:
+                writer.close()
+
+    # Method to get all of the results so far as a Pandas DataFrame, straight
+    # from memory (so there's no need to read the file back in)
+    def to_dataframe(self):
+        return pd.DataFrame(self.column_values, columns=self.columns)
@@ -0,0 +1,168 @@
+# WARM UP ANALYSIS
+# Picking the warm up period by hand is guesswork.  Too short, and our results
+# are skewed by the early part of each run, when the model was still close to
+# empty.  Too long, and we waste time simulating a warm up on every run.
+#
+# Instead, we can run a few pilot runs with no warm up at all, and look at how
+# the queuing times change over the course of the run.  Each patient's
+# queuing time is put in to a time bin (e.g. every 10 minutes) by when their
+# journey ended, and we take the mean of each bin across all of the pilot
+# runs.  The MSER-5 rule (see output_analysis.py) then tells us how many bins
+# to delete from the start of this series, and so how long the warm up needs
+# to be.  We do this for every queue, and use the longest warm up any of them
+# needs.
+#
+# MSER-5 only looks in the first half of the series.  If the truncation point
+# it finds is right at the end of that, the queues are probably still growing
+# by the end of the run (e.g. patients arrive faster than they can be seen),
+# and no warm up period will give results that represent a steady state - so
+# we flag this rather than trusting the answer.
+#
+# The recommended warm up is saved in a cache file, along with a hash of the
+# parameters of the model, so later trials of the same model with the same
+# parameters can reuse it without doing the pilot runs again.
+
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+from output_analysis import mser5_truncation_point
+from scenario import Scenario, TRIAL_SETTINGS
+
+# Parameters that don't change the warm up we need - the settings that control
+# how a trial is run (see scenario.py), and the warm up duration and seed
+# themselves
+IGNORED_PARAMETERS = TRIAL_SETTINGS | {"warm_up_duration", "master_seed"}
+
+# Pilot runs use run numbers from here upwards, so their random numbers are
+# independent of the runs in the trial itself
+PILOT_RUN_OFFSET = 1000000
+
+# Function to do a single pilot run of a model with no warm up.  The model
+# class works in the same way as for replication_runner, but must also take a
+# warm_up_duration, and record each patient's End_Time in its results_df.
+# This sits at the top level of the module so the worker processes can find
+# it
+def run_pilot_replication(model_class, master_seed, model_kwargs, run_number):
+    model = model_class(run_number, master_seed, warm_up_duration=0,
+                        **model_kwargs)
+    model.run()
+
+    return model.results_df
+
+# Class representing a warm up analyser, which keeps its recommendations in a
+# cache file
+class Warm_Up_Analyser:
+    def __init__(self, cache_file="warm_up_cache.json", bin_width=10):
+        self.cache_file = cache_file
+        self.bin_width = bin_width
+
+        if os.path.exists(cache_file):
+            with open(cache_file) as f:
+                self.cache = json.load(f)
+        else:
+            self.cache = {}
+
+    # Method to work out the key for a model and its parameters in the cache
+    # - a hash of the model's name (and the file it's in) and every parameter
+    # in the g class (or scenario) that describes the system being modelled
+    def config_key(self, model_class, params):
+        if isinstance(params, Scenario):
+            params = params.to_dict()
+        else:
+            params = vars(params)
+
+        parameters = {name:value for name, value in params.items()
+                      if not name.startswith("_")
+                      and name not in IGNORED_PARAMETERS
+                      and not callable(value)}
+        config = json.dumps([model_class.__module__, model_class.__name__,
+                             self.bin_width,
+                             sorted(parameters.items())], default=str)
+
+        return hashlib.sha256(config.encode()).hexdigest()
+
+    # Method to work out the truncation point (as a time) for one queue, from
+    # the patient level results of each pilot run
+    def truncation_time(self, pilot_results, column, run_duration):
+        number_of_bins = int(math.ceil(run_duration / self.bin_width))
+        bin_totals = np.zeros(number_of_bins)
+        bin_counts = np.zeros(number_of_bins)
+
+        for results_df in pilot_results:
+            results_df = results_df[results_df[column].notna()]
+            bins = (results_df["End_Time"].values
+                    // self.bin_width).astype(int)
+
+            bin_totals += np.bincount(bins, results_df[column].values,
+                                      number_of_bins)[:number_of_bins]
+            bin_counts += np.bincount(bins,
+                                      minlength=number_of_bins)[:number_of_bins]
+
+        # Leave out any bins nobody finished in, but remember where the rest
+        # of the bins started, so we can turn the truncation point back in to
+        # a time
+        filled_bins = np.nonzero(bin_counts)[0]
+        series = bin_totals[filled_bins] / bin_counts[filled_bins]
+
+        d = mser5_truncation_point(series)
+        steady_state = d < (len(series) // 5) // 2 * 5
+
+        if d == 0 or len(filled_bins) == 0:
+            return 0, steady_state
+
+        return filled_bins[d] * self.bin_width, steady_state
+
+    # Method to recommend a warm up period for a model, with the parameters
+    # in params (the g class, or a scenario, which is then passed to each
+    # pilot run).  If we've already done this for the same model and
+    # parameters, the cached recommendation is used
+    def recommend(self, model_class, params, columns, number_of_pilot_runs=10,
+                  master_seed=42, number_of_workers=None):
+        key = self.config_key(model_class, params)
+
+        if key in self.cache:
+            return self.cache[key]["warm_up_duration"]
+
+        if number_of_workers is None:
+            number_of_workers = os.cpu_count() or 1
+
+        run_numbers = range(PILOT_RUN_OFFSET,
+                            PILOT_RUN_OFFSET + number_of_pilot_runs)
+        model_kwargs = {"scenario":params} if isinstance(params,
+                                                         Scenario) else {}
+        run_one = partial(run_pilot_replication, model_class, master_seed,
+                          model_kwargs)
+
+        if number_of_workers == 1:
+            pilot_results = list(map(run_one, run_numbers))
+        else:
+            with ProcessPoolExecutor(max_workers=number_of_workers) as pool:
+                pilot_results = list(pool.map(run_one, run_numbers))
+
+        warm_up_duration = 0
+        steady_state = True
+
+        for column in columns:
+            column_warm_up, column_steady_state = self.truncation_time(
+                pilot_results, column, params.sim_duration)
+
+            warm_up_duration = max(warm_up_duration, column_warm_up)
+            steady_state = steady_state and column_steady_state
+
+            if not column_steady_state:
+                print (f"Warning : {column} doesn't seem to settle down " +
+                       "during the pilot runs - the queue may be growing " +
+                       "throughout the run")
+
+        self.cache[key] = {"warm_up_duration":float(warm_up_duration),
+                           "steady_state":steady_state,
+                           "number_of_pilot_runs":number_of_pilot_runs}
+
+        with open(self.cache_file, "w") as f:
+            json.dump(self.cache, f, indent=4)
+
+        return float(warm_up_duration)
@@ -17,12 +17,15 @@
 # accross patients.
 # One way we could do this would be to set up a list to store the
 # results we're interested in, and then add each patient's results
-# to the list.
-# If we do that, we need to make use of the global keyword
+# to the list. But then the list keeps growing for as long as the
+# simulation runs. Instead, we use an accumulator, which keeps running
+# totals (count, mean, variance, min and max) and updates them as each
+# patient's result comes in, so it stays the same size however long we run.
+# We need to make use of the global keyword to use it in our functions
 # For bigger models, use numpy and panda's
 import simpy
 import random
-from statistics import mean # this allows us to take a mean of a list easily
+from online_statistics import Welford_Accumulator
 
 # Arrivals generator function
 def patient_generator_weight_loss(env, wl_inter, mean_consult, nurse):
@@ -43,11 +46,12 @@ def activity_generator_weight_loss(env, mean_consult, nurse):
     # in, and we make any sort of change to it, it will set up a NEW variable
     # with the same name INSIDE the function. Usually, we don't want that.
     # By using the global keyword, we declare that the
-    # list_of_queuing_times_nurse list that we're referring to her is the same
-    # one we've declared OUTSIDE of the function (i.e towards the bottom of the 
-    # code) and not a new one. So when we add something to it here, it adds
-    # it to the global list, not a brand new list with the same name.
-    global list_of_queuing_times_nurse
+    # queuing_time_stats_nurse accumulator that we're referring to here is the
+    # same one we've declared OUTSIDE of the function (i.e towards the bottom
+    # of the code) and not a new one. So when we add something to it here, it
+    # adds it to the global accumulator, not a brand new one with the same
+    # name.
+    global queuing_time_stats_nurse
 
     time_entered_queue_for_nurse = env.now
 
@@ -58,9 +62,9 @@ def activity_generator_weight_loss(env, mean_consult, nurse):
         time_in_queue_for_nurse = (time_left_queue_for_nurse - 
                                    time_entered_queue_for_nurse)
 
-        # Append the calculated time in queue for this patient to our
-        # global list of queuing times for all patients
-        list_of_queuing_times_nurse.append(time_in_queue_for_nurse)
+        # Add the calculated time in queue for this patient to our
+        # global accumulator of queuing times for all patients
+        queuing_time_stats_nurse.update(time_in_queue_for_nurse)
 
         sampled_consultation_time = random.expovariate(1.0/mean_consult)
 
@@ -76,8 +80,8 @@ nurse = simpy.Resource(env, capacity=1)
 wl_inter = 5
 mean_consult = 6
 
-# Set up a list to store queuing times for the nurse
-list_of_queuing_times_nurse = []
+# Set up an accumulator to keep statistics on queuing times for the nurse
+queuing_time_stats_nurse = Welford_Accumulator()
 
 # Start the patients arrivals generator
 env.process(patient_generator_weight_loss(env, wl_inter, mean_consult, nurse))
@@ -85,6 +89,6 @@ env.process(patient_generator_weight_loss(env, wl_inter, mean_consult, nurse))
 # Run the simulation
 env.run(until=120)
 
-# Calculate and print mean queuing time for the nurse
-mean_queue_time_nurse = mean(list_of_queuing_times_nurse)
+# Print mean queuing time for the nurse
+mean_queue_time_nurse = queuing_time_stats_nurse.mean
 print(f"Mean queuing time for nurse (mins): {mean_queue_time_nurse:.2f}")
\ No newline at end of file